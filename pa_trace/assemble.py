@@ -1,11 +1,45 @@
-import json
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, Any
 import html
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 
-def _write_json(path: Path, obj: Any) -> None:
-    path.write_text(json.dumps(obj, indent=2, ensure_ascii=False), encoding="utf-8")
+from . import timing
+from .cache import cache_root
+from .jsonio import StoredBundle, check_shape, read_json, write_json
+
+TEMPLATE_DIR = Path(__file__).parent / "templates"
+# Compiled template bytecode, shared across processes and runs (keyed on the source checksum)
+TEMPLATE_CACHE_DIR = cache_root() / "jinja"
+
+@lru_cache(maxsize=None)
+def _template_env() -> Environment:
+    """
+    One Jinja environment per process. Templates are compiled once and kept
+    (auto_reload off, so no per-render stat); the bytecode cache lets fresh
+    processes (batch workers) skip parsing too.
+    """
+    bytecode_cache = None
+    try:
+        TEMPLATE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(str(TEMPLATE_CACHE_DIR))
+    except OSError as e:
+        print(f"[WARN] Template bytecode cache unavailable: {e}")
+    return Environment(loader=FileSystemLoader(TEMPLATE_DIR), bytecode_cache=bytecode_cache, auto_reload=False)
+
+# Output profiles for write_packet_bundle:
+#   full    packet.json, checklist.json, provenance.json (indented), packet.md, highlights.html
+#   json    the three JSON files, compact, plus bundle.json to render the rest later
+#   bundle  bundle.json only (case, retrieved policy, extracted facts, checklist, packet)
+OUTPUT_PROFILES = ["full", "json", "bundle"]
+OUTPUT_FILES = {
+    "full": ["packet.json", "checklist.json", "provenance.json", "packet.md", "highlights.html"],
+    "json": ["packet.json", "checklist.json", "provenance.json", "bundle.json"],
+    "bundle": ["bundle.json"],
+}
+
+def _write_json(path: Path, obj: Any, compact: bool = False) -> None:
+    write_json(path, obj, pretty=not compact)
 
 def _render_packet_md(bundle: Dict[str, Any]) -> str:
     case = bundle["case"]
@@ -40,7 +74,8 @@ def _render_packet_md(bundle: Dict[str, Any]) -> str:
 def _apply_marks(text: str, spans: list[dict]) -> str:
     """
     Wrap given spans with <mark> tags including category classes.
-    Uses indexed placeholders to allow safe HTML escaping of the text content.
+    Single pass: walks the tag boundaries left to right, HTML-escaping the
+    text between them, and joins the pieces once.
     """
     # Filter valid note spans
     valid_spans = [
@@ -57,56 +92,40 @@ def _apply_marks(text: str, spans: list[dict]) -> str:
     #   For End: +length (Process longest/outer first to get </Outer></Inner>)
     #   For Start: -length (Process shortest/inner first to get <Outer><Inner>)
     events = []
-    
-    # Store spans map to retrieve metadata by index
-    span_map = {}
-    
+
+    # Opening tag per span index
+    open_tags = {}
+
     for i, s in enumerate(valid_spans):
         start, end = s["start"], s["end"]
         length = end - start
-        
+
         # Clip to text bounds if necessary
         if start < 0: start = 0
         if end > len(text): end = len(text)
         if start >= end: continue
-        
-        span_map[i] = s
-        
-        # Add events
+
+        field_class = html.escape(s.get("field", "default"))
+        open_tags[i] = f'<mark id="span_{i}" class="highlight {field_class}" data-field="{field_class}">'
+
         events.append((end, 1, length, i))
         events.append((start, 0, -length, i))
 
     # Sort events descending: Position > Type > LengthPriority
+    # Tags are emitted as if inserted right to left in this order: an event
+    # processed later lands before earlier ones at the same position, so
+    # walking the list backwards gives the final left-to-right sequence.
     events.sort(key=lambda x: (x[0], x[1], x[2]), reverse=True)
 
-    out = text
-    # Insert placeholders
-    # Because we sort by position descending, we can modify 'out' without invalidating lower indices
-    for pos, type_pri, _, span_idx in events:
-        if type_pri == 1:
-            token = f"__MARK_END_{span_idx}__"
-        else:
-            token = f"__MARK_START_{span_idx}__"
-            
-        out = out[:pos] + token + out[pos:]
-
-    # Escape the text to make it HTML-safe
-    out = html.escape(out)
-
-    # Replace placeholders with actual tags
-    # We can iterate through valid_spans or just match the tokens we inserted
-    # Since tokens include span_idx, we can lookup the span
-    for i, s in span_map.items():
-        field_class = s.get("field", "default")
-        span_id = f"span_{i}"
-        
-        tag_start = f'<mark id="{span_id}" class="highlight {html.escape(field_class)}" data-field="{html.escape(field_class)}">'
-        tag_end = "</mark>"
-        
-        out = out.replace(f"__MARK_START_{i}__", tag_start)
-        out = out.replace(f"__MARK_END_{i}__", tag_end)
-
-    return out
+    parts = []
+    prev = 0
+    for pos, type_pri, _, span_idx in reversed(events):
+        if pos > prev:
+            parts.append(html.escape(text[prev:pos]))
+            prev = pos
+        parts.append("</mark>" if type_pri == 1 else open_tags[span_idx])
+    parts.append(html.escape(text[prev:]))
+    return "".join(parts)
 
 def _render_highlights_html(bundle: Dict[str, Any]) -> str:
     case = bundle["case"]
@@ -167,8 +186,7 @@ def _render_highlights_html(bundle: Dict[str, Any]) -> str:
     else:
         status_color = "#f9a825"
 
-    env = Environment(loader=FileSystemLoader(Path(__file__).parent / "templates"))
-    template = env.get_template("highlights.html.j2")
+    template = _template_env().get_template("highlights.html.j2")
     
     return template.render(
         case=case,
@@ -179,15 +197,9 @@ def _render_highlights_html(bundle: Dict[str, Any]) -> str:
         policy_chunks=bundle.get("retrieved_policy", [])
     )
 
-def write_packet_bundle(bundle: Dict[str, Any], out_dir: Path) -> None:
-    out_dir.mkdir(parents=True, exist_ok=True)
-
+def build_packet(case: Dict[str, Any], ex: Dict[str, Any], checklist: Dict[str, Any]) -> Dict[str, Any]:
     # Packet: merge "form-like" fields (minimal)
-    case = bundle["case"]
-    ex = bundle["extracted"]
-    checklist = bundle["checklist"]
-
-    packet = {
+    return {
         "case_id": case.get("case_id"),
         "exam_request": case.get("exam_request", {}),
         "patient": case.get("patient", {}),
@@ -201,8 +213,40 @@ def write_packet_bundle(bundle: Dict[str, Any], out_dir: Path) -> None:
         "checklist_overall": checklist.get("overall_status"),
     }
 
-    _write_json(out_dir / "packet.json", packet)
-    _write_json(out_dir / "checklist.json", checklist)
-    _write_json(out_dir / "provenance.json", ex.get("evidence", {}))
-    (out_dir / "packet.md").write_text(_render_packet_md(bundle), encoding="utf-8")
-    (out_dir / "highlights.html").write_text(_render_highlights_html(bundle), encoding="utf-8")
+def _write_renderings(bundle: Dict[str, Any], out_dir: Path) -> None:
+    with timing.span("write.packet_md"):
+        (out_dir / "packet.md").write_text(_render_packet_md(bundle), encoding="utf-8")
+    with timing.span("write.highlights_html"):
+        (out_dir / "highlights.html").write_text(_render_highlights_html(bundle), encoding="utf-8")
+
+def write_packet_bundle(bundle: Dict[str, Any], out_dir: Path, outputs: str = "full") -> None:
+    if outputs not in OUTPUT_PROFILES:
+        raise ValueError(f"Unknown output profile: {outputs!r} (expected one of {OUTPUT_PROFILES})")
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    case = bundle["case"]
+    ex = bundle["extracted"]
+    checklist = bundle["checklist"]
+    packet = build_packet(case, ex, checklist)
+    compact = outputs != "full"
+
+    if outputs != "bundle":
+        with timing.span("write.packet_json"):
+            _write_json(out_dir / "packet.json", packet, compact)
+        with timing.span("write.checklist_json"):
+            _write_json(out_dir / "checklist.json", checklist, compact)
+        with timing.span("write.provenance_json"):
+            _write_json(out_dir / "provenance.json", ex.get("evidence", {}), compact)
+    if outputs == "full":
+        _write_renderings(bundle, out_dir)
+    else:
+        # Everything render_bundle needs to produce packet.md / highlights.html later
+        stored = {k: bundle.get(k) for k in ("case", "retrieved_policy", "extracted", "checklist")}
+        stored["packet"] = packet
+        with timing.span("write.bundle_json"):
+            _write_json(out_dir / "bundle.json", stored, compact=True)
+
+def render_bundle(out_dir: Path) -> None:
+    """Write packet.md and highlights.html for a case folder from its stored bundle.json."""
+    bundle = check_shape(read_json(out_dir / "bundle.json"), StoredBundle, str(out_dir / "bundle.json"))
+    _write_renderings(bundle, out_dir)
@@ -0,0 +1,167 @@
+"""
+Sweep llama.cpp threads x batch size on this machine and write the fastest
+as a runtime profile.
+
+Each candidate loads the model with the active profile plus its own
+n_threads / n_batch, and generates for a few sample cases exactly as
+extraction does (prefix cache, grammar), with the completion capped at
+max_tokens so a sweep takes minutes rather than hours. n_batch mostly
+moves prompt eval and n_threads moves both, so prompt eval and decode are
+reported separately. The score is mean seconds per case.
+
+Each context is warmed up on a throwaway prompt first, so every timed case
+pays its own prompt eval (past the shared prefix, as in real runs).
+
+The written profile also sizes n_ctx: the prompt of every case in the
+folder is tokenized (no generation), and the longest, with CTX_HEADROOM for
+longer notes, plus the completion budget (MAX_TOKENS) is what a context
+needs. n_ctx is raised to that if the active profile's is too small, and
+only lowered below the active profile's (a smaller KV cache loads faster
+and leaves memory for more contexts) with shrink_ctx. The model file,
+flash attention and GPU offload stay as in the active profile; set them
+there (or via PA_TRACE_* / --profile) before tuning.
+"""
+import os
+import platform
+import time
+from dataclasses import asdict, replace
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from . import timing
+from .batch import _load_cases
+from .extraction_llm import _PRIMING_INPUTS, MAX_TOKENS, _build_messages, _generate
+from .pipeline import prepare_case
+from .policy_store import PolicyStore
+from .runtime_profile import RuntimeProfile, active_profile, write_profile
+
+DEFAULT_BATCHES = [128, 256, 512]
+DEFAULT_MAX_TOKENS = 96
+# Prompt allowance over the longest sample prompt, and n_ctx's rounding step
+CTX_HEADROOM = 1.5
+CTX_STEP = 256
+
+
+def default_thread_counts() -> List[int]:
+    """Powers of two up to the CPU count, plus the CPU count itself."""
+    cpus = os.cpu_count() or 1
+    counts = []
+    t = 1
+    while t < cpus:
+        counts.append(t)
+        t *= 2
+    return counts + [cpus]
+
+
+def _content_tokens(model, messages: List[Dict[str, str]]) -> int:
+    """Tokens in the message texts alone (the chat template adds a fixed overhead)."""
+    return sum(len(model.tokenize(m["content"].encode("utf-8"), add_bos=False)) for m in messages)
+
+
+def _prompt_lengths(base: RuntimeProfile, cases_dir: Path, policy_store: Optional[PolicyStore],
+                    retriever: str) -> Dict[str, int]:
+    """Content tokens of every case's prompt in cases_dir, by case file name (vocab-only load)."""
+    from llama_cpp import Llama
+    vocab = Llama(**base.llama_kwargs(), vocab_only=True, verbose=False)
+    lengths = {}
+    for cp in _load_cases(cases_dir):
+        case, retrieved = prepare_case(cp, policy_store, retriever)
+        lengths[cp.name] = _content_tokens(vocab, _build_messages(case.get("note_text", ""), retrieved))
+    return lengths
+
+
+def run_autotune(cases_dir: Path, out_path: Path, threads: Optional[Sequence[int]] = None,
+                 batches: Sequence[int] = DEFAULT_BATCHES, n_cases: int = 2,
+                 max_tokens: int = DEFAULT_MAX_TOKENS, policy_store: Optional[PolicyStore] = None,
+                 retriever: str = "auto", shrink_ctx: bool = False) -> Dict[str, Any]:
+    """
+    Time every (n_threads, n_batch) pair on the first n_cases cases of
+    cases_dir and write the fastest, with n_ctx sized to every case's
+    prompt, as a profile to out_path. Returns the written profile
+    (measurements under "autotune").
+    """
+    base = active_profile()
+    if not base.model_file.exists():
+        raise FileNotFoundError(f"Missing model file {base.model_file}. Run: task model")
+    try:
+        from llama_cpp import Llama
+    except ImportError:
+        raise RuntimeError("autotune needs llama-cpp-python (pip install -e .)") from None
+
+    case_paths = _load_cases(cases_dir)[:n_cases]
+    if not case_paths:
+        raise ValueError(f"No case_*.json files in {cases_dir}")
+    prompts = []
+    for cp in case_paths:
+        case, retrieved = prepare_case(cp, policy_store, retriever)
+        prompts.append(_build_messages(case.get("note_text", ""), retrieved))
+    warmup = _build_messages(*_PRIMING_INPUTS[0])
+    prompt_lengths = _prompt_lengths(base, cases_dir, policy_store, retriever)
+
+    threads = list(threads or default_thread_counts())
+    print(f"[PA-Trace] autotune: {len(threads)} thread counts x {len(batches)} batch sizes "
+          f"on {len(prompts)} case(s), {max_tokens} tokens max, model {base.model_file.name}")
+    results = []
+    # Chat template tokens on top of the message texts, from the timed prompts
+    template_tokens = 0
+    for n_threads in threads:
+        for n_batch in batches:
+            candidate = replace(base, n_threads=n_threads, n_batch=n_batch)
+            try:
+                t0 = time.perf_counter()
+                model = Llama(**candidate.llama_kwargs(), use_mmap=True, verbose=False)
+                load_s = time.perf_counter() - t0
+                # Untimed warm-up on a throwaway prompt (prefix restore, first
+                # touch of the weights), so no timed prompt is already cached
+                _generate(model, warmup, max_tokens=1)
+                with timing.collect() as timings:
+                    t0 = time.perf_counter()
+                    for messages in prompts:
+                        _, stats = _generate(model, messages, max_tokens=max_tokens)
+                        template_tokens = max(template_tokens,
+                                              stats["prompt_tokens"] - _content_tokens(model, messages))
+                    elapsed = time.perf_counter() - t0
+                del model
+            except Exception as e:
+                print(f"[WARN] autotune: n_threads={n_threads} n_batch={n_batch} failed: {e}")
+                continue
+            result = {
+                "n_threads": n_threads,
+                "n_batch": n_batch,
+                "load_s": round(load_s, 3),
+                "prompt_eval_s": round(timings.get("llm.prompt_eval", 0.0) / len(prompts), 4),
+                "decode_s": round(timings.get("llm.decode", 0.0) / len(prompts), 4),
+                "s_per_case": round(elapsed / len(prompts), 4),
+            }
+            results.append(result)
+            print(f"[PA-Trace] autotune: n_threads={n_threads:<3} n_batch={n_batch:<5} "
+                  f"{result['s_per_case']:8.2f} s/case (prompt {result['prompt_eval_s']:.2f}s, "
+                  f"decode {result['decode_s']:.2f}s)")
+    if not results:
+        raise RuntimeError("autotune: every candidate failed to run")
+
+    best = min(results, key=lambda r: r["s_per_case"])
+    longest = max(prompt_lengths, key=prompt_lengths.get)
+    max_prompt = prompt_lengths[longest] + template_tokens
+    needed = -(-(int(max_prompt * CTX_HEADROOM) + MAX_TOKENS) // CTX_STEP) * CTX_STEP
+    n_ctx = needed if shrink_ctx else max(needed, base.n_ctx)
+    profile = replace(base, n_threads=best["n_threads"], n_batch=best["n_batch"], n_ctx=n_ctx)
+    measurements = {
+        "cases": [cp.name for cp in case_paths],
+        "max_tokens": max_tokens,
+        "max_prompt_tokens": max_prompt,
+        "longest_prompt_case": longest,
+        "prompts_measured": len(prompt_lengths),
+        "n_ctx_needed": needed,
+        "cpu_count": os.cpu_count(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    write_profile(out_path, profile, {"autotune": measurements})
+    print(f"[PA-Trace] autotune: fastest n_threads={profile.n_threads} n_batch={profile.n_batch} "
+          f"({best['s_per_case']:.2f} s/case)")
+    print(f"[PA-Trace] autotune: n_ctx={n_ctx}: longest prompt {max_prompt} tokens ({longest}, "
+          f"of {len(prompt_lengths)} cases) needs {needed} with headroom and completion budget"
+          + ("" if n_ctx == needed else f"; kept the profile's {base.n_ctx} (--shrink-ctx to lower it)"))
+    print(f"[PA-Trace] Wrote runtime profile to: {out_path.resolve()}")
+    return {**asdict(profile), "autotune": measurements}
@@ -0,0 +1,458 @@
+"""
+Batch execution: fan cases out over a process pool.
+
+Each case still gets its own output directory (same layout as `run`), and
+results come back in input order so callers can aggregate them exactly as
+they would from a serial loop.
+
+For large backlogs, run_jsonl streams a JSONL file of cases to a JSONL file
+of compact result records instead, and resumes after a crash.
+"""
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+from .extraction_llm import (
+    DEFAULT_LLM_PARALLEL, context_threads, extract_facts_llm_batch, model_load_report, preload_model,
+)
+from .cache import extraction_key, get_extraction_cache
+from .pipeline import (
+    cacheable_result, case_record, extract_facts, finish_case, load_case, prepare_case, retrieve_for_case,
+    run_pipeline, write_timings,
+)
+from .incremental import (
+    load_manifest, memo_finish, memo_retrieve, record_extraction, recorded_extraction, run_pipeline_incremental,
+)
+from . import timing
+from .jsonio import Case, ExtractedFacts, check_shape, dumps, loads, read_json, write_json
+from .policy_store import PolicyStore
+
+# Policy store shared by every case a worker process runs (set by _init_worker)
+_worker_policy_store: Optional[PolicyStore] = None
+
+# Where LLM-mode model contexts live: threads of this process, or one per worker process
+LLM_POOLS = ["threads", "processes"]
+# Seconds the parent waits for every LLM worker process to load the model
+PRELOAD_TIMEOUT_S = 600
+
+
+def _load_cases(cases_dir: Path) -> List[Path]:
+    return sorted([p for p in cases_dir.glob("case_*.json") if p.is_file()])
+
+
+def _init_worker(policy_store: Optional[PolicyStore]) -> None:
+    global _worker_policy_store
+    _worker_policy_store = policy_store
+
+
+def _init_llm_worker(policy_store: Optional[PolicyStore], n_threads: int, ready: Any, reports: Any) -> None:
+    """Initializer for LLM worker processes: load the model, report, then wait for the others."""
+    _init_worker(policy_store)
+    reports.put(preload_model(1, n_threads))
+    try:
+        ready.wait(PRELOAD_TIMEOUT_S)
+    except threading.BrokenBarrierError:
+        pass
+
+
+@contextmanager
+def _llm_process_pool(workers: int, policy_store: Optional[PolicyStore], n_threads: Optional[int],
+                      load_reports: Optional[List[Dict[str, Any]]] = None) -> Iterator[ProcessPoolExecutor]:
+    """
+    A pool of `workers` processes, each holding one model context with
+    context_threads(workers, n_threads) threads. The weights
+    are mmap'd, so their pages are shared between the workers.
+
+    Every worker is started and loads the model before the pool is handed
+    out. The parent and the workers meet at a barrier, so no case waits
+    behind a cold load. Each worker's load report (pid, seconds, RSS and
+    shared MB) is appended to load_reports.
+    """
+    ctx = multiprocessing.get_context()
+    ready = ctx.Barrier(workers + 1)
+    reports = ctx.Queue()
+    n_threads = context_threads(workers, n_threads)
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_llm_worker,
+                             initargs=(policy_store, n_threads, ready, reports)) as pool:
+        # Workers may be started on demand: one task each starts them all now
+        for _ in range(workers):
+            pool.submit(os.getpid)
+        try:
+            ready.wait(PRELOAD_TIMEOUT_S)
+        except threading.BrokenBarrierError:
+            print(f"[WARN] Not every LLM worker was ready after {PRELOAD_TIMEOUT_S}s; starting anyway")
+        loaded = []
+        for _ in range(workers):
+            try:
+                loaded.append(reports.get(timeout=5))
+            except queue.Empty:
+                break
+        if load_reports is not None:
+            load_reports.extend(loaded)
+        print(f"[PA-Trace] {sum(1 for r in loaded if r.get('ok'))}/{workers} LLM workers ready "
+              f"in {time.perf_counter() - t0:.1f}s (threads per worker: {n_threads})")
+        yield pool
+
+
+def _note_inprocess_load(mode: str, load_reports: Optional[List[Dict[str, Any]]]) -> None:
+    # Runs without a worker pool load the model (if at all) in this process
+    report = model_load_report()
+    if mode == "llm" and load_reports is not None and report is not None:
+        load_reports.append(report)
+
+
+def _run_case(case_path: Path, out_root: Path, mode: str, policy_store: Optional[PolicyStore] = None,
+              retriever: str = "auto", use_cache: bool = True, outputs: str = "full",
+              incremental: bool = False) -> Dict[str, Any]:
+    if policy_store is None:
+        policy_store = _worker_policy_store
+    case = read_json(case_path)
+    run = run_pipeline_incremental if incremental else run_pipeline
+    return run(case_path, out_root / case["case_id"], mode=mode, policy_store=policy_store,
+               retriever=retriever, use_cache=use_cache, outputs=outputs)
+
+
+def _bounded_map(executor: Executor, fn: Callable[..., Any], items: Iterable[Any], window: int) -> Iterator[Any]:
+    """
+    Like executor.map, but keeps at most `window` tasks in flight so the
+    input iterable is consumed lazily. Results are yielded in input order.
+    """
+    pending: deque = deque()
+    for item in items:
+        pending.append(executor.submit(fn, *item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _extract_llm_grouped(prepared: Iterable[Tuple[Any, Dict[str, Any], List[Dict[str, Any]]]], n_parallel: int,
+                         use_cache: bool = True,
+                         known: Optional[Callable[[Any, Dict[str, Any], List[Dict[str, Any]]], Optional[Dict[str, Any]]]] = None,
+                         n_threads: Optional[int] = None,
+                         ) -> Iterator[Tuple[Any, Dict[str, Any], List[Dict[str, Any]], Dict[str, Any], Dict[str, float]]]:
+    """
+    LLM extraction for a stream of (tag, case, retrieved), in one process
+    over n_parallel model contexts. Items are taken in groups of
+    2 * n_parallel so every context stays busy; (tag, case, retrieved,
+    extracted, spans) come back in input order, spans being the item's
+    cache lookup and extraction timings (extract, llm.*) to merge into its
+    case's. Results from known(tag, case, retrieved) and cache hits skip
+    the model.
+    """
+    cache = get_extraction_cache() if use_cache else None
+    group: List[Any] = []
+
+    def flush() -> Iterator[Tuple[Any, Dict[str, Any], List[Dict[str, Any]], Dict[str, Any], Dict[str, float]]]:
+        misses = [i for i, item in enumerate(group) if item[4] is None]
+        model_spans: List[Dict[str, float]] = []
+        extracted = extract_facts_llm_batch(
+            [group[i][1].get("note_text", "") for i in misses],
+            [group[i][2] for i in misses],
+            n_parallel=n_parallel,
+            n_threads=n_threads,
+            timings=model_spans,
+        ) if misses else []
+        for i, facts, note_spans in zip(misses, extracted, model_spans):
+            tag, case, retrieved, key, _, spans = group[i]
+            timing.merge(spans, note_spans)
+            if cache is not None:
+                with timing.collect(spans), timing.span("cache_store"):
+                    cache.put(key, cacheable_result(facts))
+            group[i] = (tag, case, retrieved, key, facts, spans)
+        for tag, case, retrieved, _, facts, spans in group:
+            yield tag, case, retrieved, facts, spans
+        group.clear()
+
+    for tag, case, retrieved in prepared:
+        key = hit = None
+        if known is not None:
+            hit = known(tag, case, retrieved)
+        with timing.collect() as spans:
+            if hit is None and cache is not None:
+                with timing.span("cache_lookup"):
+                    key = extraction_key("llm", case.get("note_text", ""), retrieved)
+                    hit = cache.get(key)
+                if hit is not None:
+                    check_shape(hit, ExtractedFacts, "cached extraction")
+        group.append((tag, case, retrieved, key, hit, spans))
+        if len(group) >= 2 * n_parallel:
+            yield from flush()
+    if group:
+        yield from flush()
+
+
+def _run_llm_cases(case_paths: Iterable[Path], out_root: Path, n_parallel: int,
+                   policy_store: Optional[PolicyStore] = None, retriever: str = "auto",
+                   use_cache: bool = True, outputs: str = "full", incremental: bool = False,
+                   n_threads: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    LLM mode for a folder of cases: no process pool, n_parallel model contexts
+    of n_threads threads each.
+    Per-case timings include the case's own extraction spans (extract,
+    llm.*), recorded on the replica thread that ran it. With incremental, each case's stage manifest is consulted
+    first and only cases whose extraction inputs changed reach the model.
+    """
+    def prepared() -> Iterator[Tuple[Tuple[Dict[str, float], Any], Dict[str, Any], List[Dict[str, Any]]]]:
+        for cp in case_paths:
+            with timing.collect() as timings:
+                if incremental:
+                    case = load_case(cp)
+                    manifest = load_manifest(out_root / case["case_id"])
+                    retrieved = memo_retrieve(manifest, case, policy_store, retriever)
+                else:
+                    manifest = None
+                    case, retrieved = prepare_case(cp, policy_store, retriever)
+            yield (timings, manifest), case, retrieved
+
+    known = None
+    if incremental:
+        known = lambda tag, case, retrieved: recorded_extraction(tag[1], "llm", case, retrieved)
+    for (timings, manifest), case, retrieved, facts, spans in _extract_llm_grouped(prepared(), n_parallel, use_cache,
+                                                                                   known, n_threads):
+        out_dir = out_root / case["case_id"]
+        timing.merge(timings, spans)
+        with timing.collect(timings):
+            if manifest is None:
+                bundle = finish_case(case, retrieved, facts, out_dir, outputs)
+            else:
+                record_extraction(manifest, "llm", case, retrieved, facts)
+                bundle = memo_finish(manifest, case, retrieved, facts, out_dir, outputs)
+        bundle["timings"] = timings
+        write_timings(out_dir, timings)
+        yield bundle
+
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def run_cases(case_paths: Iterable[Path], out_root: Path, mode: str = "baseline", workers: int = 1,
+              policy_store: Optional[PolicyStore] = None, retriever: str = "auto",
+              use_cache: bool = True, outputs: str = "full", incremental: bool = False,
+              llm_pool: str = "threads", llm_threads: Optional[int] = None,
+              load_reports: Optional[List[Dict[str, Any]]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Run the pipeline on every case, yielding bundles in input order.
+
+    workers <= 1 runs in-process (no pool); otherwise cases are fanned out
+    over a ProcessPoolExecutor with `workers` processes. A given policy_store
+    is shipped to each worker once, not once per case.
+
+    In LLM mode `workers` is the number of model replicas, each with
+    llm_threads threads. With llm_pool="threads" they are contexts in this
+    process. With "processes" each is a worker process that preloads its
+    model before the first case (see _llm_process_pool). Model load reports
+    go to load_reports.
+
+    incremental re-runs only the stages whose inputs or code changed since
+    the last run into out_root (see incremental.py).
+    """
+    if llm_pool not in LLM_POOLS:
+        raise ValueError(f"Unknown llm_pool: {llm_pool!r} (expected one of {LLM_POOLS})")
+    if mode == "llm" and llm_pool == "processes" and workers > 1:
+        items = ((cp, out_root, mode, None, retriever, use_cache, outputs, incremental) for cp in case_paths)
+        with _llm_process_pool(workers, policy_store, llm_threads, load_reports) as pool:
+            yield from _bounded_map(pool, _run_case, items, window=workers * 2)
+        return
+    if mode == "llm" and workers > 1:
+        yield from _run_llm_cases(case_paths, out_root, workers, policy_store, retriever, use_cache, outputs,
+                                  incremental, llm_threads)
+        _note_inprocess_load(mode, load_reports)
+        return
+    if workers <= 1:
+        for cp in case_paths:
+            yield _run_case(cp, out_root, mode, policy_store, retriever, use_cache, outputs, incremental)
+        _note_inprocess_load(mode, load_reports)
+        return
+    items = ((cp, out_root, mode, None, retriever, use_cache, outputs, incremental) for cp in case_paths)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(policy_store,)) as pool:
+        yield from _bounded_map(pool, _run_case, items, window=workers * 4)
+
+
+def run_batch(cases_dir: Path, out_dir: Path, mode: str = "baseline", workers: Optional[int] = None,
+              policy_store: Optional[PolicyStore] = None, retriever: str = "auto",
+              use_cache: bool = True, outputs: str = "full", incremental: bool = False,
+              llm_pool: str = "threads", llm_threads: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Run the pipeline over a folder of cases (no gold labels) and report throughput.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    workers = workers or (DEFAULT_LLM_PARALLEL if mode == "llm" else default_workers())
+    case_paths = _load_cases(cases_dir)
+
+    t0 = time.perf_counter()
+    decisions: Dict[str, int] = {}
+    llm_tokens: Dict[str, int] = {}
+    load_reports: List[Dict[str, Any]] = []
+    n = 0
+    for bundle in run_cases(case_paths, out_dir, mode=mode, workers=workers,
+                            policy_store=policy_store, retriever=retriever, use_cache=use_cache,
+                            outputs=outputs, incremental=incremental, llm_pool=llm_pool,
+                            llm_threads=llm_threads, load_reports=load_reports):
+        status = bundle["checklist"].get("overall_status")
+        decisions[status] = decisions.get(status, 0) + 1
+        for k, v in bundle["extracted"].get("llm_stats", {}).items():
+            llm_tokens[k] = llm_tokens.get(k, 0) + int(v)
+        n += 1
+    elapsed = time.perf_counter() - t0
+
+    summary = {
+        "mode": mode,
+        "workers": workers,
+        "n_cases": n,
+        "elapsed_s": round(elapsed, 3),
+        "cases_per_sec": round(n / elapsed, 2) if elapsed > 0 else None,
+        "decisions": decisions,
+    }
+    if llm_tokens:
+        summary["llm_tokens"] = llm_tokens
+    if load_reports:
+        summary["model_load"] = load_reports
+    write_json(out_dir / "batch_summary.json", summary, pretty=True)
+
+    print(f"[PA-Trace] Batch complete: {n} cases in {elapsed:.2f}s "
+          f"({summary['cases_per_sec']} cases/sec, {workers} workers)")
+    print(f"[PA-Trace] Summary written to: {(out_dir / 'batch_summary.json').resolve()}")
+    return summary
+
+
+# -----------------------------------------------------------------------------
+# JSONL streaming (cases.jsonl -> results.jsonl)
+# -----------------------------------------------------------------------------
+PROGRESS_EVERY = 1000
+
+
+def _read_jsonl(path: Path, after_line: int = 0) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """(1-based line number, case) for each non-blank line past after_line, read lazily."""
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f, start=1):
+            if n <= after_line or not line.strip():
+                continue
+            try:
+                case = loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{n}: invalid JSON ({e})") from None
+            yield n, check_shape(case, Case, f"{path}:{n}")
+
+
+def _resume_line(out_path: Path) -> int:
+    """
+    Input line of the last complete record in out_path (0 if none). A torn
+    final line left by a crash is truncated away so appending stays valid.
+    """
+    if not out_path.exists():
+        return 0
+    last = 0
+    good_bytes = 0
+    with open(out_path, "rb") as f:
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                break
+            try:
+                last = loads(raw)["line"]
+            except (ValueError, KeyError, TypeError):
+                break
+            good_bytes += len(raw)
+    if good_bytes != out_path.stat().st_size:
+        with open(out_path, "r+b") as f:
+            f.truncate(good_bytes)
+    return last
+
+
+def _run_record(line_no: int, case: Dict[str, Any], mode: str, policy_store: Optional[PolicyStore] = None,
+                retriever: str = "auto", use_cache: bool = True) -> Dict[str, Any]:
+    if policy_store is None:
+        policy_store = _worker_policy_store
+    retrieved = retrieve_for_case(case, policy_store, retriever)
+    extracted = extract_facts(case.get("note_text", ""), retrieved, mode=mode, use_cache=use_cache)
+    return {"line": line_no, **case_record(case, extracted)}
+
+
+def run_records(records: Iterable[Tuple[int, Dict[str, Any]]], mode: str = "baseline", workers: int = 1,
+                policy_store: Optional[PolicyStore] = None, retriever: str = "auto",
+                use_cache: bool = True, llm_pool: str = "threads", llm_threads: Optional[int] = None,
+                load_reports: Optional[List[Dict[str, Any]]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Stream (line number, case) pairs to compact result records, in input
+    order. Same execution strategies as run_cases, without per-case files.
+    """
+    if llm_pool not in LLM_POOLS:
+        raise ValueError(f"Unknown llm_pool: {llm_pool!r} (expected one of {LLM_POOLS})")
+    if mode == "llm" and llm_pool == "processes" and workers > 1:
+        items = ((n, case, mode, None, retriever, use_cache) for n, case in records)
+        with _llm_process_pool(workers, policy_store, llm_threads, load_reports) as pool:
+            yield from _bounded_map(pool, _run_record, items, window=workers * 2)
+        return
+    if mode == "llm" and workers > 1:
+        prepared = ((n, case, retrieve_for_case(case, policy_store, retriever)) for n, case in records)
+        for n, case, _, facts, _ in _extract_llm_grouped(prepared, workers, use_cache, n_threads=llm_threads):
+            yield {"line": n, **case_record(case, facts)}
+        _note_inprocess_load(mode, load_reports)
+        return
+    if workers <= 1:
+        for n, case in records:
+            yield _run_record(n, case, mode, policy_store, retriever, use_cache)
+        _note_inprocess_load(mode, load_reports)
+        return
+    items = ((n, case, mode, None, retriever, use_cache) for n, case in records)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(policy_store,)) as pool:
+        yield from _bounded_map(pool, _run_record, items, window=workers * 4)
+
+
+def run_jsonl(in_path: Path, out_path: Path, mode: str = "baseline", workers: Optional[int] = None,
+              policy_store: Optional[PolicyStore] = None, retriever: str = "auto", use_cache: bool = True,
+              overwrite: bool = False, llm_pool: str = "threads", llm_threads: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Run every case in a JSONL file, appending one result record per line to
+    out_path. Memory stays constant in the number of cases. An existing
+    out_path is resumed after its last complete record unless overwrite.
+    """
+    workers = workers or (DEFAULT_LLM_PARALLEL if mode == "llm" else default_workers())
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    if overwrite and out_path.exists():
+        out_path.unlink()
+    resumed_after = _resume_line(out_path)
+    if resumed_after:
+        print(f"[PA-Trace] Resuming after input line {resumed_after}")
+
+    t0 = time.perf_counter()
+    decisions: Dict[str, int] = {}
+    load_reports: List[Dict[str, Any]] = []
+    n = 0
+    with open(out_path, "a", encoding="utf-8") as out:
+        for rec in run_records(_read_jsonl(in_path, after_line=resumed_after), mode=mode, workers=workers,
+                               policy_store=policy_store, retriever=retriever, use_cache=use_cache,
+                               llm_pool=llm_pool, llm_threads=llm_threads, load_reports=load_reports):
+            out.write(dumps(rec) + "\n")
+            out.flush()
+            status = rec["checklist"].get("overall_status")
+            decisions[status] = decisions.get(status, 0) + 1
+            n += 1
+            if n % PROGRESS_EVERY == 0:
+                print(f"[PA-Trace] {n} cases done (line {rec['line']})")
+    elapsed = time.perf_counter() - t0
+
+    summary = {
+        "mode": mode,
+        "workers": workers,
+        "n_cases": n,
+        "resumed_after_line": resumed_after,
+        "elapsed_s": round(elapsed, 3),
+        "cases_per_sec": round(n / elapsed, 2) if elapsed > 0 else None,
+        "decisions": decisions,
+    }
+    if load_reports:
+        summary["model_load"] = load_reports
+    print(f"[PA-Trace] Batch complete: {n} cases in {elapsed:.2f}s "
+          f"({summary['cases_per_sec']} cases/sec, {workers} workers)")
+    print(f"[PA-Trace] Results written to: {out_path.resolve()}")
+    return summary
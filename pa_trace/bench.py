@@ -0,0 +1,265 @@
+"""
+Benchmarks over synthetic notes.
+
+synth_note builds a clinical-style note from the same keyword tables the
+baseline extractor uses (TREATMENT_KEYWORDS, RED_FLAG_KEYWORDS,
+_WORD_TO_NUM), with knobs for length, keyword density, negation rate and
+duration phrasing. run_bench times the hot paths over 1k/10k/100k notes:
+
+  extract    extract_facts_baseline
+  retrieval  retrieve_for_case (policy store + retriever as configured)
+  marks      assemble._apply_marks on each note's evidence spans
+  bundle     write_packet_bundle (render + write all five files)
+
+Results are a JSON file; compare_results diffs two of them (e.g. from two
+commits) and reports benchmarks that got slower than a threshold.
+"""
+import json
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from .assemble import _apply_marks, write_packet_bundle
+from .checklist import build_checklist
+from .extraction_baseline import (
+    RED_FLAG_KEYWORDS, TREATMENT_KEYWORDS, _NEGATION_PREFIXES, _WORD_TO_NUM, extract_facts_baseline,
+)
+from .pipeline import retrieve_for_case
+from .policy_store import PolicyStore
+
+BENCHMARKS = ["extract", "retrieval", "marks", "bundle"]
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+DURATION_STYLES = ["digits", "words", "hyphen", "mixed"]
+
+# Bundles are written round-robin into this many folders, so a 100k run
+# measures rendering and writing without leaving 100k folders behind
+BUNDLE_DIRS = 64
+
+_NUM_TO_WORD = {v: w for w, v in _WORD_TO_NUM.items()}
+
+_PROCEDURES = ["Lumbar spine MRI", "Cervical spine MRI", "Thoracic spine MRI", "Lumbar spine CT"]
+
+# Filler sentences carry no treatment, red-flag or duration keyword
+_FILLER = [
+    "Reports low back pain radiating to the left leg.",
+    "Pain is worse with sitting and bending.",
+    "Sleep is disrupted by the pain.",
+    "Exam shows tenderness over the lumbar paraspinals.",
+    "Straight leg raise is positive on the right.",
+    "Reflexes are symmetric and gait is normal.",
+    "Works as a warehouse manager.",
+    "Rates the pain as seven out of ten.",
+    "Would like to discuss imaging options.",
+    "Vitals are within normal limits.",
+]
+
+
+# -----------------------------------------------------------------------------
+# Synthetic notes
+# -----------------------------------------------------------------------------
+
+def _duration(rng: random.Random, style: str) -> str:
+    if style == "mixed":
+        style = rng.choice(DURATION_STYLES[:-1])
+    unit = rng.choice(["week", "month"])
+    value = rng.randint(1, 12) if unit == "week" else rng.randint(1, 6)
+    if style == "hyphen":
+        return f"{value}-{unit}"
+    num = _NUM_TO_WORD[value] if style == "words" else str(value)
+    return f"{num} {unit}" + ("s" if value != 1 else "")
+
+
+def _treatment_sentence(rng: random.Random, style: str) -> str:
+    kw = rng.choice(TREATMENT_KEYWORDS[rng.choice(list(TREATMENT_KEYWORDS))])
+    dur = _duration(rng, style)
+    if "-" in dur:
+        return f"Completed the {dur} course of {kw}."
+    return rng.choice([f"Completed {dur} of {kw}.", f"Has been doing {kw} for {dur}.",
+                       f"Tried {kw} without relief."])
+
+
+def _red_flag_sentence(rng: random.Random, negation_rate: float) -> str:
+    kw = rng.choice(RED_FLAG_KEYWORDS[rng.choice(list(RED_FLAG_KEYWORDS))])
+    if rng.random() < negation_rate:
+        return f"{rng.choice(_NEGATION_PREFIXES).capitalize()} {kw}."
+    return f"Reports {kw}."
+
+
+def synth_note(rng: random.Random, length: int = 400, keyword_density: float = 0.5,
+               negation_rate: float = 0.7, duration_style: str = "mixed") -> str:
+    """
+    One synthetic note of about `length` characters. Each sentence after the
+    opening symptoms line is a keyword sentence with probability
+    keyword_density (a treatment, or a red flag negated with probability
+    negation_rate); the rest are filler. duration_style picks how durations
+    are written: "8 weeks", "eight weeks", "8-week", or a mix.
+    """
+    if duration_style not in DURATION_STYLES:
+        raise ValueError(f"Unknown duration style: {duration_style!r} (expected one of {DURATION_STYLES})")
+    dur = _duration(rng, duration_style)
+    if "-" in dur:
+        opening = f"{rng.randint(18, 85)}-year-old with a {dur} history of low back pain."
+    else:
+        opening = f"{rng.randint(18, 85)}-year-old with low back pain for {dur}."
+    sentences = [opening]
+    size = len(sentences[0])
+    while size < length:
+        if rng.random() < keyword_density:
+            if rng.random() < 0.5:
+                s = _treatment_sentence(rng, duration_style)
+            else:
+                s = _red_flag_sentence(rng, negation_rate)
+        else:
+            s = rng.choice(_FILLER)
+        sentences.append(s)
+        size += len(s) + 1
+    return " ".join(sentences)
+
+
+def synth_cases(n: int, seed: int = 0, **note_kwargs: Any) -> List[Dict[str, Any]]:
+    """n synthetic cases in the cases/*.json layout; note_kwargs go to synth_note."""
+    rng = random.Random(seed)
+    cases = []
+    for i in range(n):
+        procedure = rng.choice(_PROCEDURES)
+        cases.append({
+            "case_id": f"synth_{i:06d}",
+            "patient": {"age": rng.randint(18, 85), "sex": rng.choice(["F", "M"])},
+            "requesting_provider": {"name": "Dr. Synthetic", "role": "Ordering clinician"},
+            "exam_request": {"procedure": procedure, "modality": procedure.rsplit(" ", 1)[1],
+                             "body_part": procedure.rsplit(" ", 1)[0].capitalize()},
+            "note_text": synth_note(rng, **note_kwargs),
+        })
+    return cases
+
+
+# -----------------------------------------------------------------------------
+# Benchmarks
+# -----------------------------------------------------------------------------
+
+def _note_spans(extracted: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # Same flattening as assemble._render_highlights_html
+    spans = []
+    for field, span_list in extracted.get("evidence", {}).items():
+        for sp in span_list:
+            if sp.get("source") == "note":
+                spans.append(dict(sp, field=field))
+    return spans
+
+
+def _timed(fn: Callable[[], None], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).resolve().parent,
+                             capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def run_bench(out_path: Path, sizes: List[int] = DEFAULT_SIZES, benchmarks: List[str] = BENCHMARKS,
+              repeat: int = 1, seed: int = 0, policy_store: Optional[PolicyStore] = None,
+              retriever: str = "auto", **note_kwargs: Any) -> Dict[str, Any]:
+    """
+    Time each benchmark at each size (best of `repeat`) and write the results
+    JSON to out_path. The notes are generated once, for the largest size, and
+    each size runs over a prefix of them.
+    """
+    unknown = [b for b in benchmarks if b not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"Unknown benchmark(s): {unknown} (expected any of {BENCHMARKS})")
+    sizes = sorted(sizes)
+    t0 = time.perf_counter()
+    cases = synth_cases(sizes[-1], seed=seed, **note_kwargs)
+    print(f"[PA-Trace] bench: generated {len(cases)} notes in {time.perf_counter() - t0:.1f}s")
+
+    # Inputs for the later stages, computed outside the timed regions
+    retrieved = [retrieve_for_case(c, policy_store, retriever) for c in cases] \
+        if {"marks", "bundle"} & set(benchmarks) else []
+    extracted = [extract_facts_baseline(c["note_text"], r) for c, r in zip(cases, retrieved)]
+    spans = [_note_spans(ex) for ex in extracted]
+
+    results: Dict[str, Dict[str, Any]] = {}
+    with tempfile.TemporaryDirectory(prefix="pa_trace_bench_") as tmp:
+        tmp_root = Path(tmp)
+        for name in benchmarks:
+            results[name] = {}
+            for n in sizes:
+                if name == "extract":
+                    def fn(n=n):
+                        for c in cases[:n]:
+                            extract_facts_baseline(c["note_text"], [])
+                elif name == "retrieval":
+                    def fn(n=n):
+                        for c in cases[:n]:
+                            retrieve_for_case(c, policy_store, retriever)
+                elif name == "marks":
+                    def fn(n=n):
+                        for c, sp in zip(cases[:n], spans):
+                            _apply_marks(c["note_text"], sp)
+                else:
+                    def fn(n=n):
+                        for i, c in enumerate(cases[:n]):
+                            ex = extracted[i]
+                            bundle = {"case": c, "retrieved_policy": retrieved[i], "extracted": ex,
+                                      "checklist": build_checklist(ex)}
+                            write_packet_bundle(bundle, tmp_root / f"bundle_{i % BUNDLE_DIRS:02d}")
+                seconds = _timed(fn, repeat)
+                results[name][str(n)] = {
+                    "seconds": round(seconds, 6),
+                    "us_per_note": round(seconds / n * 1e6, 3),
+                    "notes_per_sec": round(n / seconds, 1) if seconds > 0 else None,
+                }
+                print(f"[PA-Trace] bench: {name:<9} n={n:<7} {seconds:8.3f}s  "
+                      f"{results[name][str(n)]['us_per_note']:10.1f} us/note")
+
+    report = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "repeat": repeat,
+        "retriever": retriever,
+        "notes": note_kwargs,
+        "results": results,
+    }
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"[PA-Trace] Wrote bench results to: {out_path.resolve()}")
+    return report
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any],
+                    threshold: float = 0.10) -> List[Dict[str, Any]]:
+    """
+    Compare per-note times of two bench reports. Prints one line per
+    benchmark/size present in both and returns the ones that got more than
+    `threshold` (fractional) slower.
+    """
+    regressions = []
+    for name, by_size in current["results"].items():
+        for n, cur in by_size.items():
+            old = baseline.get("results", {}).get(name, {}).get(n)
+            if not old or not old.get("us_per_note"):
+                continue
+            change = cur["us_per_note"] / old["us_per_note"] - 1
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions.append({"benchmark": name, "n": int(n), "before_us": old["us_per_note"],
+                                    "after_us": cur["us_per_note"], "change": round(change, 4)})
+            print(f"[PA-Trace] bench: {name:<9} n={n:<7} {old['us_per_note']:10.1f} -> "
+                  f"{cur['us_per_note']:10.1f} us/note ({change:+.1%}){flag}")
+    return regressions
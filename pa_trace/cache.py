@@ -0,0 +1,170 @@
+"""
+Content-addressed on-disk cache of extraction results.
+
+The key hashes everything an extraction depends on: mode, note text, the
+retrieved chunks (ids + text) and an extractor fingerprint (extractor
+source, and for llm mode the prompt and the model file's size/mtime).
+Re-running unchanged cases then skips extraction entirely, while an edit
+to any input misses the cache.
+
+Entries are small JSON files; the least recently used are evicted once the
+directory grows past max_bytes. Safe to share between worker processes:
+writes are atomic and eviction tolerates files vanishing underneath it.
+Baseline extraction is cheaper than a cache round trip, so only model
+results are cached.
+
+All of pa_trace's on-disk caches (this one, the prompt prefix state, the
+template bytecode) live under cache_root(): PA_TRACE_CACHE_DIR, else
+$XDG_CACHE_HOME/pa_trace, else ~/.cache/pa_trace. Never the install
+directory, which may be a read-only or shared site-packages.
+"""
+import hashlib
+import json
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .jsonio import dumps, loads
+
+CACHE_ENV = "PA_TRACE_CACHE_DIR"
+
+
+def cache_root() -> Path:
+    """Root of pa_trace's on-disk caches (PA_TRACE_CACHE_DIR, else the user cache dir)."""
+    if os.environ.get(CACHE_ENV):
+        return Path(os.environ[CACHE_ENV])
+    xdg = os.environ.get("XDG_CACHE_HOME")
+    return (Path(xdg) if xdg else Path.home() / ".cache") / "pa_trace"
+
+
+CACHE_DIR = cache_root() / "extract"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Only deterministic outcomes are cached; a fallback after a model error is not
+CACHEABLE_MODES = {"baseline", "llm", "llm_refused"}
+
+_PKG_DIR = Path(__file__).resolve().parent
+
+
+@lru_cache(maxsize=None)
+def _extractor_fingerprint(mode: str) -> str:
+    h = hashlib.sha256()
+    sources = ["extraction_baseline.py"]
+    if mode == "llm":
+        from .extraction_llm import SYSTEM_PROMPT
+        from .prompt_template import PROMPT_TEMPLATE
+        from .runtime_profile import active_profile
+        # note_index backs span validation and the boost spans in llm output
+        sources += ["extraction_llm.py", "prompt_template.py", "note_index.py"]
+        profile = active_profile()
+        model_file = profile.model_file
+        try:
+            st = model_file.stat()
+            model = [str(model_file.resolve()), st.st_size, st.st_mtime_ns]
+        except OSError:
+            model = [str(model_file), None, None]
+        # n_ctx decides which notes overflow and fall back; flash_attn changes the numerics
+        model += [profile.n_ctx, profile.flash_attn]
+        h.update(json.dumps([model, SYSTEM_PROMPT, PROMPT_TEMPLATE]).encode("utf-8"))
+    for name in sources:
+        h.update((_PKG_DIR / name).read_bytes())
+    return h.hexdigest()
+
+
+def extraction_key(mode: str, note_text: str, retrieved_policy: List[Dict[str, Any]]) -> str:
+    chunks = [[c.get("chunk_id"), c.get("text")] for c in retrieved_policy]
+    payload = json.dumps([mode, _extractor_fingerprint(mode), note_text, chunks], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    """Extraction results under root/<key[:2]>/<key>.json, LRU-bounded to max_bytes."""
+
+    def __init__(self, root: Path = CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._size: Optional[int] = None  # bytes on disk, scanned on first put
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            value = loads(path.read_bytes())
+            os.utime(path)  # mtime doubles as last-use time for LRU eviction
+        except (OSError, ValueError):
+            return None
+        return value
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        if value.get("extraction_mode") not in CACHEABLE_MODES:
+            return
+        path = self._path(key)
+        data = dumps(value).encode("utf-8")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"[WARN] Could not write extraction cache entry: {e}")
+            return
+        if self._size is None:
+            self._size = self._scan_size()
+        else:
+            self._size += len(data)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self) -> List[os.DirEntry]:
+        entries = []
+        if not self.root.is_dir():
+            return entries
+        for sub in os.scandir(self.root):
+            if sub.is_dir():
+                entries.extend(e for e in os.scandir(sub.path) if e.name.endswith(".json"))
+        return entries
+
+    def _scan_size(self) -> int:
+        total = 0
+        for e in self._entries():
+            try:
+                total += e.stat().st_size
+            except OSError:
+                pass
+        return total
+
+    def evict(self) -> None:
+        """Drop least recently used entries until the cache is under 90% of max_bytes."""
+        stats = []
+        for e in self._entries():
+            try:
+                st = e.stat()
+            except OSError:
+                continue
+            stats.append((st.st_mtime_ns, st.st_size, e.path))
+        stats.sort()
+        total = sum(size for _, size, _ in stats)
+        target = self.max_bytes * 0.9
+        for _, size, path in stats:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self._size = total
+
+
+_cache: Optional[ExtractionCache] = None
+
+
+def get_extraction_cache() -> ExtractionCache:
+    """Process-wide cache at CACHE_DIR."""
+    global _cache
+    if _cache is None:
+        _cache = ExtractionCache()
+    return _cache
@@ -1,31 +1,167 @@
 import argparse
 import json
+import os
 from pathlib import Path
 
 from .pipeline import run_pipeline
+from .incremental import run_pipeline_incremental
 from .eval import run_eval
+from .batch import LLM_POOLS, run_batch, run_jsonl
+from .retrieval import RETRIEVERS
+from .policy_store import get_policy_store
+from .policy_index import build_policy_index
+from .server import DEFAULT_HOST, DEFAULT_PORT, serve
+from .assemble import OUTPUT_PROFILES, render_bundle
+from .bench import BENCHMARKS, DEFAULT_SIZES, DURATION_STYLES, compare_results, run_bench
+from .runtime_profile import DEFAULT_PROFILE_PATH, PROFILE_ENV, active_profile, load_profile
+from .autotune import DEFAULT_BATCHES, DEFAULT_MAX_TOKENS, run_autotune
 
 def main():
     parser = argparse.ArgumentParser(prog="pa-trace", description="PA-Trace UI-less MVP")
+    parser.add_argument("--profile", default=None, help=f"llama.cpp runtime profile JSON (default: {PROFILE_ENV}, else models/runtime_profile.json if present)")
     sub = parser.add_subparsers(dest="cmd", required=True)
 
     p_run = sub.add_parser("run", help="Run pipeline on a single case")
     p_run.add_argument("--case", required=True, help="Path to case JSON")
     p_run.add_argument("--out", required=True, help="Output directory")
     p_run.add_argument("--mode", choices=["baseline", "llm"], default="baseline", help="Extraction mode")
+    p_run.add_argument("--policy", default=None, help="Policy JSON or compiled index (default: demo spine MRI policy)")
+    p_run.add_argument("--retriever", choices=RETRIEVERS, default="auto", help="Policy retriever (auto: BM25 for large stores)")
+    p_run.add_argument("--no-cache", action="store_true", help="Bypass the on-disk extraction cache (no reads or writes)")
+    p_run.add_argument("--outputs", choices=OUTPUT_PROFILES, default="full", help="Files to write (json/bundle: compact, render later)")
+    p_run.add_argument("--incremental", action="store_true", help="Re-run only stages whose inputs or code changed since the last run into --out")
 
     p_eval = sub.add_parser("eval", help="Evaluate pipeline on a folder of cases")
     p_eval.add_argument("--cases", required=True, help="Folder with case_*.json")
     p_eval.add_argument("--gold", required=True, help="Gold labels JSON")
     p_eval.add_argument("--out", required=True, help="Output directory")
     p_eval.add_argument("--mode", choices=["baseline", "llm"], default="baseline", help="Extraction mode")
+    p_eval.add_argument("--policy", default=None, help="Policy JSON or compiled index (default: demo spine MRI policy)")
+    p_eval.add_argument("--retriever", choices=RETRIEVERS, default="auto", help="Policy retriever (auto: BM25 for large stores)")
+    p_eval.add_argument("--no-cache", action="store_true", help="Bypass the on-disk extraction cache (no reads or writes)")
+    p_eval.add_argument("--workers", type=int, default=1, help="Worker processes (1 = run in-process)")
+    p_eval.add_argument("--outputs", choices=OUTPUT_PROFILES, default="full", help="Files to write per case (json/bundle: compact, render later)")
+    p_eval.add_argument("--incremental", action="store_true", help="Re-run only stages whose inputs or code changed since the last run into --out")
+    p_eval.add_argument("--bootstrap", type=int, default=1000, help="Bootstrap resamples for the 95%% intervals in eval_aggregates.json (0 = off)")
+    p_eval.add_argument("--llm-pool", choices=LLM_POOLS, default="threads", help="With --mode llm and --workers > 1: model replicas as contexts in this process, or as preloaded worker processes")
+    p_eval.add_argument("--llm-threads", type=int, default=None, help="With --mode llm: threads per model replica (default: CPU count / replicas)")
+    p_eval.add_argument("--export-table", default=None, help="Also write the per-case gold/predicted table (.parquet, .feather, .arrow or .csv; needs pyarrow)")
+
+    p_batch = sub.add_parser("batch", help="Run pipeline on a folder of cases in parallel (no gold labels)")
+    p_batch_in = p_batch.add_mutually_exclusive_group(required=True)
+    p_batch_in.add_argument("--cases", help="Folder with case_*.json")
+    p_batch_in.add_argument("--in", dest="in_path", help="JSONL file, one case per line (streamed)")
+    p_batch.add_argument("--out", required=True, help="Output directory, or results .jsonl with --in")
+    p_batch.add_argument("--mode", choices=["baseline", "llm"], default="baseline", help="Extraction mode")
+    p_batch.add_argument("--policy", default=None, help="Policy JSON or compiled index (default: demo spine MRI policy)")
+    p_batch.add_argument("--retriever", choices=RETRIEVERS, default="auto", help="Policy retriever (auto: BM25 for large stores)")
+    p_batch.add_argument("--no-cache", action="store_true", help="Bypass the on-disk extraction cache (no reads or writes)")
+    p_batch.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    p_batch.add_argument("--overwrite", action="store_true", help="With --in: start over instead of resuming --out")
+    p_batch.add_argument("--outputs", choices=OUTPUT_PROFILES, default="full", help="With --cases: files to write per case (json/bundle: compact, render later)")
+    p_batch.add_argument("--incremental", action="store_true", help="With --cases: re-run only stages whose inputs or code changed since the last run into --out")
+    p_batch.add_argument("--llm-pool", choices=LLM_POOLS, default="threads", help="With --mode llm: model replicas as contexts in this process, or as preloaded worker processes")
+    p_batch.add_argument("--llm-threads", type=int, default=None, help="With --mode llm: threads per model replica (default: CPU count / replicas)")
+
+    p_render = sub.add_parser("render", help="Write packet.md + highlights.html for case folders run with --outputs json/bundle")
+    p_render.add_argument("--out", required=True, help="Case folder, or a folder of case folders")
+
+    p_index = sub.add_parser("index", help="Manage compiled policy indexes")
+    index_sub = p_index.add_subparsers(dest="index_cmd", required=True)
+    p_index_build = index_sub.add_parser("build", help="Compile policy JSON files into a memory-mappable index")
+    p_index_build.add_argument("--policy", required=True, nargs="+", help="Policy JSON file(s)")
+    p_index_build.add_argument("--out", required=True, help="Index file to write")
+
+    p_serve = sub.add_parser("serve", help="Keep the model loaded and serve extraction requests on localhost")
+    p_serve.add_argument("--host", default=DEFAULT_HOST, help="Bind address (no authentication: keep it on loopback)")
+    p_serve.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port")
+
+    p_bench = sub.add_parser("bench", help="Benchmark extraction, retrieval, highlighting and bundle writing on synthetic notes")
+    p_bench.add_argument("--out", default="runs/bench.json", help="Results JSON to write")
+    p_bench.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="Comma-separated note counts")
+    p_bench.add_argument("--bench", nargs="+", choices=BENCHMARKS, default=BENCHMARKS, help="Benchmarks to run")
+    p_bench.add_argument("--repeat", type=int, default=1, help="Runs per benchmark and size (best is kept)")
+    p_bench.add_argument("--seed", type=int, default=0, help="Synthetic note RNG seed")
+    p_bench.add_argument("--note-chars", type=int, default=400, help="Approximate note length in characters")
+    p_bench.add_argument("--keyword-density", type=float, default=0.5, help="Fraction of sentences with a treatment/red-flag keyword")
+    p_bench.add_argument("--negation-rate", type=float, default=0.7, help="Fraction of red-flag mentions that are negated")
+    p_bench.add_argument("--durations", choices=DURATION_STYLES, default="mixed", help="Duration phrasing")
+    p_bench.add_argument("--policy", default=None, help="Policy JSON or compiled index (default: demo spine MRI policy)")
+    p_bench.add_argument("--retriever", choices=RETRIEVERS, default="auto", help="Policy retriever (auto: BM25 for large stores)")
+    p_bench.add_argument("--compare", default=None, help="Earlier results JSON to compare against")
+    p_bench.add_argument("--threshold", type=float, default=0.10, help="Slowdown that counts as a regression (0.10 = 10%%)")
+
+    p_autotune = sub.add_parser("autotune", help="Time llama.cpp thread/batch settings on sample cases and write the fastest as a runtime profile")
+    p_autotune.add_argument("--cases", default="cases", help="Folder with case_*.json")
+    p_autotune.add_argument("--out", default=None, help="Profile JSON to write (default: models/runtime_profile.json, which later runs pick up)")
+    p_autotune.add_argument("--threads", default=None, help="Comma-separated thread counts (default: powers of two up to the CPU count)")
+    p_autotune.add_argument("--batch", default=",".join(map(str, DEFAULT_BATCHES)), help="Comma-separated n_batch values")
+    p_autotune.add_argument("--n-cases", type=int, default=2, help="Cases timed per setting")
+    p_autotune.add_argument("--max-tokens", type=int, default=DEFAULT_MAX_TOKENS, help="Completion cap per case while timing")
+    p_autotune.add_argument("--shrink-ctx", action="store_true", help="Let n_ctx go below the active profile's when the case prompts fit a smaller one")
+    p_autotune.add_argument("--policy", default=None, help="Policy JSON or compiled index (default: demo spine MRI policy)")
+    p_autotune.add_argument("--retriever", choices=RETRIEVERS, default="auto", help="Policy retriever (auto: BM25 for large stores)")
 
     args = parser.parse_args()
+    if args.profile:
+        # Through the environment, so worker processes load the same profile
+        os.environ[PROFILE_ENV] = args.profile
+        active_profile.cache_clear()
+        load_profile()  # fail here on a bad profile, not at the first model load
+    policy_store = get_policy_store(Path(args.policy)) if args.cmd in ("run", "eval", "batch", "bench", "autotune") and args.policy else None
 
     if args.cmd == "run":
-        run_pipeline(case_path=Path(args.case), out_dir=Path(args.out), mode=args.mode)
+        run = run_pipeline_incremental if args.incremental else run_pipeline
+        run(case_path=Path(args.case), out_dir=Path(args.out), mode=args.mode,
+            policy_store=policy_store, retriever=args.retriever, use_cache=not args.no_cache,
+            outputs=args.outputs, use_server=True)
     elif args.cmd == "eval":
-        run_eval(cases_dir=Path(args.cases), gold_path=Path(args.gold), out_dir=Path(args.out), mode=args.mode)
+        run_eval(cases_dir=Path(args.cases), gold_path=Path(args.gold), out_dir=Path(args.out), mode=args.mode, workers=args.workers,
+                 policy_store=policy_store, retriever=args.retriever, use_cache=not args.no_cache,
+                 outputs=args.outputs, incremental=args.incremental, bootstrap=args.bootstrap,
+                 export_table=Path(args.export_table) if args.export_table else None,
+                 llm_pool=args.llm_pool, llm_threads=args.llm_threads)
+    elif args.cmd == "batch" and args.in_path:
+        run_jsonl(in_path=Path(args.in_path), out_path=Path(args.out), mode=args.mode, workers=args.workers,
+                  policy_store=policy_store, retriever=args.retriever, use_cache=not args.no_cache,
+                  overwrite=args.overwrite, llm_pool=args.llm_pool, llm_threads=args.llm_threads)
+    elif args.cmd == "batch":
+        run_batch(cases_dir=Path(args.cases), out_dir=Path(args.out), mode=args.mode, workers=args.workers,
+                  policy_store=policy_store, retriever=args.retriever, use_cache=not args.no_cache,
+                  outputs=args.outputs, incremental=args.incremental, llm_pool=args.llm_pool,
+                  llm_threads=args.llm_threads)
+    elif args.cmd == "render":
+        root = Path(args.out)
+        case_dirs = [root] if (root / "bundle.json").exists() else sorted(p.parent for p in root.glob("*/bundle.json"))
+        for case_dir in case_dirs:
+            render_bundle(case_dir)
+        print(f"[PA-Trace] Rendered {len(case_dirs)} case folder(s) under: {root.resolve()}")
+    elif args.cmd == "bench":
+        report = run_bench(out_path=Path(args.out), sizes=[int(n) for n in args.sizes.split(",")],
+                           benchmarks=args.bench, repeat=args.repeat, seed=args.seed,
+                           policy_store=policy_store, retriever=args.retriever,
+                           length=args.note_chars, keyword_density=args.keyword_density,
+                           negation_rate=args.negation_rate, duration_style=args.durations)
+        if args.compare:
+            baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+            regressions = compare_results(baseline, report, threshold=args.threshold)
+            if regressions:
+                print(f"[WARN] {len(regressions)} benchmark(s) slower than {args.threshold:.0%}")
+                raise SystemExit(1)
+    elif args.cmd == "autotune":
+        profile = run_autotune(cases_dir=Path(args.cases), out_path=Path(args.out) if args.out else DEFAULT_PROFILE_PATH,
+                     threads=[int(n) for n in args.threads.split(",")] if args.threads else None,
+                     batches=[int(n) for n in args.batch.split(",")], n_cases=args.n_cases,
+                     max_tokens=args.max_tokens, policy_store=policy_store, retriever=args.retriever,
+                     shrink_ctx=args.shrink_ctx)
+        profile.pop("autotune")
+        print(json.dumps(profile, indent=2))
+    elif args.cmd == "serve":
+        serve(host=args.host, port=args.port)
+    elif args.cmd == "index" and args.index_cmd == "build":
+        info = build_policy_index([Path(p) for p in args.policy], Path(args.out))
+        print(f"[PA-Trace] Indexed {info['n_chunks']} chunks / {info['n_terms']} terms "
+              f"({info['bytes']} bytes) -> {Path(info['path']).resolve()}")
 
 if __name__ == "__main__":
     main()
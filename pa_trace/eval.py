@@ -1,20 +1,22 @@
-import json
+import time
 from pathlib import Path
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, Optional, Tuple
 
-from .pipeline import run_pipeline
+from .batch import _load_cases, run_cases
+from .eval_table import DEFAULT_RESAMPLES, TABLE_FORMATS, EvalTable
+from .jsonio import read_json, write_json
+from .note_index import note_index
+from .policy_store import PolicyStore
+from .timing import percentiles
 
 FIELDS = ["symptoms_duration_weeks", "conservative_care_weeks", "red_flags_present"]
 
-def _load_cases(cases_dir: Path) -> List[Path]:
-    return sorted([p for p in cases_dir.glob("case_*.json") if p.is_file()])
-
 def _validate_provenance(case: Dict[str, Any], bundle: Dict[str, Any]) -> Tuple[int,int]:
     """
     Returns (valid_evidence_count, total_evidence_count) where "valid" means
     quote is a substring of the declared source text.
     """
-    note = case.get("note_text", "")
+    note = note_index(case.get("note_text", ""))
     policy_chunks = {c["chunk_id"]: c["text"] for c in bundle.get("retrieved_policy", [])}
     evidence = bundle.get("extracted", {}).get("evidence", {})
     valid = 0
@@ -30,80 +32,159 @@ def _validate_provenance(case: Dict[str, Any], bundle: Dict[str, Any]) -> Tuple[
                 valid += 1
             elif src == "policy":
                 cid = sp.get("chunk_id")
-                if cid and cid in policy_chunks and q in policy_chunks[cid]:
+                if cid and cid in policy_chunks and q in note_index(policy_chunks[cid]):
                     valid += 1
     return valid, total
 
-def run_eval(cases_dir: Path, gold_path: Path, out_dir: Path, mode: str = "baseline") -> Dict[str, Any]:
+def _fmt(v: Optional[float]) -> str:
+    return "n/a" if v is None else f"{v:.2f}"
+
+def run_eval(cases_dir: Path, gold_path: Path, out_dir: Path, mode: str = "baseline", workers: int = 1,
+             policy_store: Optional[PolicyStore] = None, retriever: str = "auto",
+             use_cache: bool = True, outputs: str = "full", incremental: bool = False,
+             bootstrap: int = DEFAULT_RESAMPLES, export_table: Optional[Path] = None,
+             llm_pool: str = "threads", llm_threads: Optional[int] = None) -> Dict[str, Any]:
+    if export_table is not None and export_table.suffix.lower() not in TABLE_FORMATS:
+        raise ValueError(f"Unknown table format: {export_table.suffix!r} (expected one of {TABLE_FORMATS})")
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    gold = json.loads(gold_path.read_text(encoding="utf-8"))
+    gold = read_json(gold_path)
     case_paths = _load_cases(cases_dir)
 
-    y_true = {f: [] for f in FIELDS}
-    y_pred = {f: [] for f in FIELDS}
-    decision_true = []
-    decision_pred = []
+    # Columns for the EvalTable; overall_status is the decision
+    case_ids = []
+    y_true = {f: [] for f in FIELDS + ["overall_status"]}
+    y_pred = {f: [] for f in FIELDS + ["overall_status"]}
+    flags_true = []
+    flags_pred = []
 
     prov_valid = 0
     prov_total = 0
-
-    for cp in case_paths:
-        case = json.loads(cp.read_text(encoding="utf-8"))
+    n_fallback = 0
+    completion_tokens = []
+    stage_ms: Dict[str, list] = {}
+
+    t0 = time.perf_counter()
+    for bundle in run_cases(case_paths, out_dir, mode=mode, workers=workers,
+                             policy_store=policy_store, retriever=retriever, use_cache=use_cache,
+                             outputs=outputs, incremental=incremental, llm_pool=llm_pool,
+                             llm_threads=llm_threads):
+        case = bundle["case"]
         case_id = case["case_id"]
-        bundle = run_pipeline(cp, out_dir / case_id, mode=mode)
 
         ex = bundle["extracted"]
         chk = bundle["checklist"]
 
         g = gold[case_id]
 
+        case_ids.append(case_id)
         for f in FIELDS:
             y_true[f].append(g.get(f))
             y_pred[f].append(ex.get(f))
+        y_true["overall_status"].append(g.get("expected_status"))
+        y_pred["overall_status"].append(chk.get("overall_status"))
+        flags_true.append(g.get("red_flags", []))
+        flags_pred.append(ex.get("red_flags", []))
+
+        if ex.get("extraction_mode") == "llm_fallback_baseline":
+            n_fallback += 1
+        if "llm_stats" in ex:
+            completion_tokens.append(ex["llm_stats"]["completion_tokens"])
 
-        decision_true.append(g.get("expected_status"))
-        decision_pred.append(chk.get("overall_status"))
+        for stage, sec in bundle.get("timings", {}).items():
+            stage_ms.setdefault(stage, []).append(sec * 1000)
 
         v,t = _validate_provenance(case, bundle)
         prov_valid += v
         prov_total += t
+    elapsed = time.perf_counter() - t0
 
-    def acc(a,b):
-        n = len(a)
-        return sum(1 for i in range(n) if a[i] == b[i]) / n if n else 0.0
+    table = EvalTable(case_ids, y_true, y_pred, flags_true, flags_pred)
 
     metrics = {
         "mode": mode,
         "n_cases": len(case_paths),
-        "field_accuracy": {f: acc(y_true[f], y_pred[f]) for f in FIELDS},
-        "decision_accuracy": acc(decision_true, decision_pred),
+        "field_accuracy": {f: table.accuracy(f) for f in FIELDS},
+        "decision_accuracy": table.accuracy("overall_status"),
         "provenance_valid_rate": (prov_valid / prov_total) if prov_total else None,
     }
 
     # Abstention precision on UNKNOWN cases
-    unknown_idx = [i for i, d in enumerate(decision_true) if d == "UNKNOWN"]
-    if unknown_idx:
-        abstain_correct = sum(1 for i in unknown_idx if decision_pred[i] == "UNKNOWN")
-        metrics["abstention_precision_on_unknown"] = abstain_correct / len(unknown_idx)
-    else:
-        metrics["abstention_precision_on_unknown"] = None
-
-    (out_dir / "metrics.json").write_text(json.dumps(metrics, indent=2), encoding="utf-8")
+    metrics["abstention_precision_on_unknown"] = table.class_recall("overall_status", "UNKNOWN")
+
+    # Share of LLM cases that fell back to baseline (model/inference/parse failure)
+    if mode == "llm":
+        metrics["fallback_rate"] = n_fallback / len(case_paths) if case_paths else None
+        # Decode cost of cases that reached the model (cache hits carry no stats)
+        metrics["mean_completion_tokens"] = (
+            sum(completion_tokens) / len(completion_tokens) if completion_tokens else None
+        )
+
+    write_json(out_dir / "metrics.json", metrics, pretty=True)
+
+    # Aggregates beyond metrics.json (whose keys stay fixed for run-to-run comparison)
+    confusion = table.confusion("overall_status")
+    aggregates = {
+        "n_cases": len(table),
+        "decision_confusion": {"labels": table.categories["overall_status"], "matrix": confusion.tolist()},
+        "red_flags": table.label_scores(),
+        "bootstrap": {"resamples": bootstrap, "intervals_95": table.bootstrap(bootstrap)},
+    }
+    write_json(out_dir / "eval_aggregates.json", aggregates, pretty=True)
+    if export_table is not None:
+        try:
+            table.export(export_table)
+            print(f"[PA-Trace] Wrote eval table to: {export_table.resolve()}")
+        except ImportError as e:
+            print(f"[WARN] Eval table not written: {e}")
 
     report = []
     report.append("# PA-Trace Evaluation Report\n")
     report.append(f"- Mode: {mode}")
     report.append(f"- Cases: {metrics['n_cases']}")
+    intervals = aggregates["bootstrap"]["intervals_95"]
+
+    def ci(stat: str) -> str:
+        lo_hi = intervals.get(stat)
+        return f" (95% CI {lo_hi[0]:.2f}–{lo_hi[1]:.2f})" if lo_hi else ""
+
     report.append("\n## Field accuracy")
     for f, v in metrics["field_accuracy"].items():
-        report.append(f"- {f}: {v:.2f}")
-    report.append(f"\n## Decision accuracy\n- {metrics['decision_accuracy']:.2f}")
+        report.append(f"- {f}: {v:.2f}{ci('accuracy.' + f)}")
+    report.append(f"\n## Decision accuracy\n- {metrics['decision_accuracy']:.2f}{ci('accuracy.overall_status')}")
+    labels = table.categories["overall_status"]
+    report.append("\n## Decision confusion (rows: gold, columns: predicted)")
+    report.append("| gold \\ pred | " + " | ".join(str(lb) for lb in labels) + " |")
+    report.append("|---" * (len(labels) + 1) + "|")
+    for lb, row in zip(labels, confusion.tolist()):
+        report.append(f"| {lb} | " + " | ".join(str(c) for c in row) + " |")
+    scores = aggregates["red_flags"]
+    report.append("\n## Red flags")
+    report.append(f"- micro F1: {_fmt(scores['micro']['f1'])}{ci('red_flags.micro_f1')}")
+    report.append(f"- macro F1: {_fmt(scores['macro_f1'])}")
+    report.append("| label | precision | recall | f1 | support |")
+    report.append("|---|---|---|---|---|")
+    for lb, sc in scores["labels"].items():
+        report.append(f"| {lb} | {_fmt(sc['precision'])} | {_fmt(sc['recall'])} | {_fmt(sc['f1'])} | {sc['support']} |")
     if metrics["provenance_valid_rate"] is not None:
         report.append(f"\n## Provenance validity rate\n- {metrics['provenance_valid_rate']:.2f}")
     if metrics.get("abstention_precision_on_unknown") is not None:
         report.append(f"\n## Abstention precision (on UNKNOWN gold cases)\n- {metrics['abstention_precision_on_unknown']:.2f}")
+    if metrics.get("fallback_rate") is not None:
+        report.append(f"\n## LLM fallback rate (cases extracted by baseline instead)\n- {metrics['fallback_rate']:.2f}")
+    if metrics.get("mean_completion_tokens") is not None:
+        report.append(f"\n## Mean completion tokens per generated case\n- {metrics['mean_completion_tokens']:.1f}")
+    if stage_ms:
+        # Stages in pipeline order (first seen); percentiles over cases that ran the stage
+        report.append("\n## Stage timings (ms)")
+        report.append("| stage | n | p50 | p95 | p99 |")
+        report.append("|---|---|---|---|---|")
+        for stage, values in stage_ms.items():
+            p = percentiles(values)
+            report.append(f"| {stage} | {len(values)} | {p['p50']:.3f} | {p['p95']:.3f} | {p['p99']:.3f} |")
     (out_dir / "eval_report.md").write_text("\n".join(report) + "\n", encoding="utf-8")
 
+    if elapsed > 0:
+        print(f"[PA-Trace] Throughput: {len(case_paths) / elapsed:.2f} cases/sec ({workers} workers)")
     print(f"[PA-Trace] Eval complete. Metrics written to: {out_dir.resolve()}")
     return metrics
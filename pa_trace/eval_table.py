@@ -0,0 +1,222 @@
+"""
+Columnar eval table: gold and predicted values per case, one NumPy array per column.
+
+Scalar columns (the extracted FIELDS and overall_status) are stored as
+integer codes into a per-column category list shared by gold and
+prediction. Codes are assigned through a dict, so two values get the same
+code exactly when they compare equal in Python (8 and 8.0, None and None),
+and accuracy over codes matches a row-by-row `==`. Red flags are a
+multi-label column: one boolean matrix of cases x labels for gold and one
+for predictions.
+
+Everything after construction is vectorized: accuracy, confusion matrices,
+per-label precision/recall/F1 and percentile bootstrap intervals, which
+stay in the seconds range at 100k cases. to_pandas / to_arrow / export are
+optional (pandas, pyarrow).
+"""
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .extraction_baseline import RED_FLAG_KEYWORDS
+
+STATUSES = ["MET", "NOT_MET", "UNKNOWN"]
+RED_FLAG_LABELS = list(RED_FLAG_KEYWORDS)
+
+TABLE_FORMATS = [".parquet", ".feather", ".arrow", ".csv"]
+
+DEFAULT_RESAMPLES = 1000
+DEFAULT_CONFIDENCE = 0.95
+
+
+def _factorize(true_values: Sequence[Any], pred_values: Sequence[Any],
+               known: Iterable[Any] = ()) -> Tuple[np.ndarray, np.ndarray, List[Any]]:
+    codes: Dict[Any, int] = {}
+    for v in known:
+        codes.setdefault(v, len(codes))
+    t = np.fromiter((codes.setdefault(v, len(codes)) for v in true_values), dtype=np.int32, count=len(true_values))
+    p = np.fromiter((codes.setdefault(v, len(codes)) for v in pred_values), dtype=np.int32, count=len(pred_values))
+    return t, p, list(codes)
+
+
+def _multi_hot(rows: Sequence[Iterable[str]], labels: List[str]) -> np.ndarray:
+    index = {label: j for j, label in enumerate(labels)}
+    out = np.zeros((len(rows), len(labels)), dtype=bool)
+    for i, row in enumerate(rows):
+        for label in row:
+            out[i, index[label]] = True
+    return out
+
+
+def _ratio(num: int, den: int) -> Optional[float]:
+    return num / den if den else None
+
+
+def _prf(tp: int, fp: int, fn: int) -> Dict[str, Any]:
+    precision = _ratio(tp, tp + fp)
+    recall = _ratio(tp, tp + fn)
+    f1 = _ratio(2 * tp, 2 * tp + fp + fn)
+    return {"precision": precision, "recall": recall, "f1": f1, "support": tp + fn}
+
+
+class EvalTable:
+    """Gold vs predicted values for n cases, stored column-wise."""
+
+    def __init__(self, case_ids: Sequence[str], true: Dict[str, Sequence[Any]], pred: Dict[str, Sequence[Any]],
+                 flags_true: Sequence[Iterable[str]], flags_pred: Sequence[Iterable[str]]):
+        self.case_ids = np.asarray(case_ids, dtype=object)
+        self.codes_true: Dict[str, np.ndarray] = {}
+        self.codes_pred: Dict[str, np.ndarray] = {}
+        self.categories: Dict[str, List[Any]] = {}
+        for col in true:
+            known = STATUSES if col == "overall_status" else ()
+            self.codes_true[col], self.codes_pred[col], self.categories[col] = _factorize(true[col], pred[col], known)
+
+        flags_true = [list(r) for r in flags_true]
+        flags_pred = [list(r) for r in flags_pred]
+        seen = {label for rows in (flags_true, flags_pred) for r in rows for label in r}
+        self.flag_labels = RED_FLAG_LABELS + sorted(seen - set(RED_FLAG_LABELS))
+        self.flags_true = _multi_hot(flags_true, self.flag_labels)
+        self.flags_pred = _multi_hot(flags_pred, self.flag_labels)
+
+    def __len__(self) -> int:
+        return len(self.case_ids)
+
+    # -------------------------------------------------------------------------
+    # Scalar columns
+    # -------------------------------------------------------------------------
+
+    def correct(self, col: str) -> np.ndarray:
+        return self.codes_true[col] == self.codes_pred[col]
+
+    def accuracy(self, col: str) -> float:
+        n = len(self)
+        return int(np.count_nonzero(self.correct(col))) / n if n else 0.0
+
+    def confusion(self, col: str) -> np.ndarray:
+        """k x k counts, rows = gold, columns = predicted, in categories[col] order."""
+        k = len(self.categories[col])
+        flat = self.codes_true[col].astype(np.int64) * k + self.codes_pred[col]
+        return np.bincount(flat, minlength=k * k).reshape(k, k)
+
+    def class_recall(self, col: str, value: Any) -> Optional[float]:
+        """Share of cases with gold == value that were predicted as value (None if there are none)."""
+        if value not in self.categories[col]:
+            return None
+        j = self.categories[col].index(value)
+        row = self.confusion(col)[j]
+        return _ratio(int(row[j]), int(row.sum()))
+
+    # -------------------------------------------------------------------------
+    # Red flags (multi-label)
+    # -------------------------------------------------------------------------
+
+    def _flag_counts(self, axis: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        t, p = self.flags_true, self.flags_pred
+        return (t & p).sum(axis=axis), (~t & p).sum(axis=axis), (t & ~p).sum(axis=axis)
+
+    def label_scores(self) -> Dict[str, Any]:
+        """Per red-flag label precision/recall/F1/support, plus micro and macro averages."""
+        tp, fp, fn = self._flag_counts(axis=0)
+        per_label = {label: _prf(int(tp[j]), int(fp[j]), int(fn[j])) for j, label in enumerate(self.flag_labels)}
+        f1s = [s["f1"] for s in per_label.values() if s["f1"] is not None]
+        return {
+            "labels": per_label,
+            "micro": _prf(int(tp.sum()), int(fp.sum()), int(fn.sum())),
+            "macro_f1": sum(f1s) / len(f1s) if f1s else None,
+        }
+
+    # -------------------------------------------------------------------------
+    # Bootstrap
+    # -------------------------------------------------------------------------
+
+    def bootstrap(self, n_resamples: int = DEFAULT_RESAMPLES, confidence: float = DEFAULT_CONFIDENCE,
+                  seed: int = 0) -> Dict[str, List[float]]:
+        """
+        Percentile bootstrap intervals for each column's accuracy and the
+        red flags' micro F1, all from the same resamples. Every statistic is
+        a function of per-case counts (correct or not per column, flag
+        tp/fp/fn), which take only a handful of distinct values. A resample
+        of n cases is then a multinomial draw of how many times each
+        distinct row comes up. That has the same distribution as drawing case
+        indices, but costs resamples x distinct rows instead of
+        resamples x n.
+        """
+        n = len(self)
+        if not n or n_resamples <= 0:
+            return {}
+        cols = list(self.codes_true)
+        tp, fp, fn = self._flag_counts(axis=1)
+        per_case = np.column_stack([self.correct(c) for c in cols] + [tp, fp, fn]).astype(np.int64)
+        rows, freq = np.unique(per_case, axis=0, return_counts=True)
+
+        rng = np.random.default_rng(seed)
+        sums = rng.multinomial(n, freq / n, size=n_resamples) @ rows
+
+        stats = {f"accuracy.{c}": sums[:, i] / n for i, c in enumerate(cols)}
+        s_tp, s_fp, s_fn = (sums[:, len(cols) + i] for i in range(3))
+        den = 2 * s_tp + s_fp + s_fn
+        if den.any():
+            # Resamples with no gold or predicted flag at all have no F1; leave them out
+            stats["red_flags.micro_f1"] = np.divide(2 * s_tp, den, out=np.full(n_resamples, np.nan), where=den > 0)
+
+        lo, hi = (1 - confidence) / 2, (1 + confidence) / 2
+        return {name: [float(np.nanquantile(v, lo)), float(np.nanquantile(v, hi))] for name, v in stats.items()}
+
+    # -------------------------------------------------------------------------
+    # Export
+    # -------------------------------------------------------------------------
+
+    def decoded(self, col: str, which: str = "true") -> List[Any]:
+        codes = self.codes_true[col] if which == "true" else self.codes_pred[col]
+        return np.asarray(self.categories[col], dtype=object)[codes].tolist()
+
+    def _flag_lists(self, matrix: np.ndarray) -> List[List[str]]:
+        labels = np.asarray(self.flag_labels, dtype=object)
+        return [labels[row].tolist() for row in matrix]
+
+    def to_columns(self) -> Dict[str, List[Any]]:
+        """Plain column dict: case_id, then <col>_true / <col>_pred per column, then red flags."""
+        out: Dict[str, List[Any]] = {"case_id": self.case_ids.tolist()}
+        for col in self.codes_true:
+            out[f"{col}_true"] = self.decoded(col, "true")
+            out[f"{col}_pred"] = self.decoded(col, "pred")
+        out["red_flags_true"] = self._flag_lists(self.flags_true)
+        out["red_flags_pred"] = self._flag_lists(self.flags_pred)
+        return out
+
+    def to_pandas(self) -> Any:
+        try:
+            import pandas as pd
+        except ImportError:
+            raise ImportError("to_pandas needs pandas: pip install -e \".[eval-export]\"") from None
+        return pd.DataFrame(self.to_columns())
+
+    def to_arrow(self) -> Any:
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("to_arrow needs pyarrow: pip install -e \".[eval-export]\"") from None
+        return pa.table(self.to_columns())
+
+    def export(self, path: Path) -> None:
+        """Write the table as .parquet, .feather/.arrow or .csv (via pyarrow)."""
+        suffix = path.suffix.lower()
+        if suffix not in TABLE_FORMATS:
+            raise ValueError(f"Unknown table format: {path.suffix!r} (expected one of {TABLE_FORMATS})")
+        table = self.to_arrow()
+        if suffix == ".parquet":
+            import pyarrow.parquet as pq
+            pq.write_table(table, path)
+        elif suffix in (".feather", ".arrow"):
+            import pyarrow.feather as feather
+            feather.write_feather(table, path)
+        else:
+            import pyarrow.csv as pcsv
+            # CSV has no list type: join the red flag labels
+            for name in ("red_flags_true", "red_flags_pred"):
+                i = table.schema.get_field_index(name)
+                joined = [";".join(v) for v in table.column(name).to_pylist()]
+                table = table.set_column(i, name, [joined])
+            pcsv.write_csv(table, path)
@@ -1,5 +1,6 @@
 import re
-from typing import Dict, Any, List
+from functools import lru_cache
+from typing import Dict, Any, List, NamedTuple, Optional, Tuple
 
 TREATMENT_KEYWORDS = {
     "pt": ["physical therapy", "pt"],
@@ -24,8 +25,67 @@ _WORD_TO_NUM = {
     "eleven": 11, "twelve": 12,
 }
 
-# Regex fragment that matches a number — either digits or word-form
-_NUM_PAT = r"(\d{1,2}|" + "|".join(_WORD_TO_NUM.keys()) + r")"
+# -----------------------------------------------------------------------------
+# Duration pattern registry
+# -----------------------------------------------------------------------------
+# Duration units: name -> (regex fragment, weeks per unit)
+DURATION_UNITS: Dict[str, Tuple[str, int]] = {
+    "week": (r"weeks?", 1),
+    "month": (r"months?", 4),
+}
+
+# Treatment name patterns for conservative care matching
+_CARE_NAMES = [
+    r"physical therapy", r"pt\b", r"home exercises?",
+    r"chiropractic", r"chiro",
+]
+
+
+class DurationMention(NamedTuple):
+    """
+    One duration phrase found by scan_durations. `kind` is:
+      - "duration":  "<N> <unit>"                 (start/end cover just that)
+      - "care_of":   "<N> <unit> of <treatment>"
+      - "care_for":  "<treatment> for <N> <unit>"
+    `digits` tells whether N was written with digits, `sep` is the text
+    between N and the unit (e.g. " ", "-").
+    """
+    kind: str
+    start: int
+    end: int
+    value: int
+    unit: str
+    weeks: int
+    digits: bool
+    sep: str
+
+
+def _compile_duration_patterns() -> None:
+    """(Re)build the compiled patterns from DURATION_UNITS and _CARE_NAMES."""
+    global _UNIT_RE, _UNIT_NAMES, _CARE_BEFORE_RE, _CARE_OF_AFTER_RE
+    care_pat = "|".join(_CARE_NAMES)
+    # Unit words are rare and start with a literal, so scanning for them is
+    # cheap; the number (digits or word-form, see _number_before) and the
+    # treatment name are then matched right around each hit.
+    _UNIT_RE = re.compile("|".join(pat for pat, _ in DURATION_UNITS.values()))
+    _UNIT_NAMES = {}
+    _CARE_BEFORE_RE = re.compile(r"(?:" + care_pat + r")\Z")
+    _CARE_OF_AFTER_RE = re.compile(r"\s+of\s+(?:" + care_pat + r")")
+
+
+def register_duration_unit(name: str, pattern: str, weeks_per_unit: int) -> None:
+    """Register a duration unit (e.g. "year", r"years?", 52) for the duration scanner."""
+    DURATION_UNITS[name] = (pattern, weeks_per_unit)
+    _compile_duration_patterns()
+
+
+def register_care_name(pattern: str) -> None:
+    """Register an extra conservative-care treatment name pattern (e.g. r"massage")."""
+    _CARE_NAMES.append(pattern)
+    _compile_duration_patterns()
+
+
+_compile_duration_patterns()
 
 
 def _to_int(s: str) -> int | None:
@@ -36,48 +96,127 @@ def _to_int(s: str) -> int | None:
     return _WORD_TO_NUM.get(s)
 
 
+def _unit_name(unit: str) -> str | None:
+    name = _UNIT_NAMES.get(unit)
+    if name is None:
+        for name, (pat, _) in DURATION_UNITS.items():
+            if re.fullmatch(pat, unit):
+                _UNIT_NAMES[unit] = name
+                break
+        else:
+            return None
+    return name
+
+
 def _to_weeks(value: int, unit: str) -> int:
-    """Convert a duration value + unit to weeks."""
-    if "month" in unit:
-        return value * 4
-    return value
+    """Convert a duration value + unit (matched text, e.g. "months") to weeks."""
+    name = _unit_name(unit)
+    return value * DURATION_UNITS[name][1] if name else value
+
+
+# How far back from "for" to look for a treatment name
+_CARE_LOOKBEHIND = 64
+
 
+def _skip_space_back(tl: str, i: int) -> int:
+    while i > 0 and tl[i - 1].isspace():
+        i -= 1
+    return i
 
-def _find_weeks(text: str) -> int | None:
+
+def _number_before(tl: str, end: int) -> tuple[int, str] | None:
+    """
+    Match NUM + r"\s*-?\s*" ending exactly at `end` (the start of a unit word).
+    Returns (number start, number text) or None.
+    """
+    i = _skip_space_back(tl, end)
+    if i > 0 and tl[i - 1] == "-":
+        i = _skip_space_back(tl, i - 1)
+    j = i
+    while j > 0 and i - j < 2 and tl[j - 1].isdigit():
+        j -= 1
+    if j < i:
+        return j, tl[j:i]
+    for word in _WORD_TO_NUM:
+        if tl.endswith(word, 0, i):
+            return i - len(word), word
+    return None
+
+
+def _care_for_before(tl: str, end: int) -> int | None:
+    """
+    Match r"(<treatment>)\s+for\s+" ending exactly at `end` (the start of a
+    number). Returns the treatment's start offset or None.
+    """
+    i = _skip_space_back(tl, end)
+    if i == end or not tl.endswith("for", 0, i):
+        return None
+    j = _skip_space_back(tl, i - 3)
+    if j == i - 3:
+        return None
+    lo = max(0, j - _CARE_LOOKBEHIND)
+    m = _CARE_BEFORE_RE.search(tl, lo, j)
+    if m and m.start() == lo and lo > 0:
+        m = _CARE_BEFORE_RE.search(tl, 0, j)
+    return m.start() if m else None
+
+
+def scan_durations(text: str) -> List[DurationMention]:
+    """
+    Single pass over the note returning every duration mention with offsets,
+    including the conservative-care phrases that contain them.
+    """
+    tl = text.lower()
+    out: List[DurationMention] = []
+    for u in _UNIT_RE.finditer(tl):
+        found = _number_before(tl, u.start())
+        if not found:
+            continue
+        num_start, num = found
+        v = _to_int(num)
+        if v is None:
+            continue
+        sep = tl[num_start + len(num):u.start()]
+        unit = u.group()
+        mention = DurationMention("duration", num_start, u.end(), v, _unit_name(unit),
+                                  _to_weeks(v, unit), num.isdigit(), sep)
+        out.append(mention)
+        if not sep.isspace():
+            continue
+        care_start = _care_for_before(tl, num_start)
+        if care_start is not None:
+            out.append(mention._replace(kind="care_for", start=care_start))
+        tail = _CARE_OF_AFTER_RE.match(tl, u.end())
+        if tail:
+            out.append(mention._replace(kind="care_of", end=tail.end()))
+    return out
+
+
+def _find_weeks(text: str, mentions: Optional[List[DurationMention]] = None) -> int | None:
     """
     Extract a coarse duration in weeks from phrases like:
       - "8 weeks", "6-week"
       - "3 months", "two months"
     """
-    tl = text.lower()
+    if mentions is None:
+        mentions = scan_durations(text)
+    bare = [d for d in mentions if d.kind == "duration"]
     # digit-form weeks: "8 weeks", "6-week"
-    m = re.search(r"(\d{1,2})\s*-?\s*weeks?", tl)
-    if m:
-        return int(m.group(1))
+    for d in bare:
+        if d.digits and d.unit == "week":
+            return d.value
     # digit-form months: "3 months"
-    m2 = re.search(r"(\d{1,2})\s*months?", tl)
-    if m2:
-        return int(m2.group(1)) * 4
-    # word-form: "two months", "six weeks"
-    pat = _NUM_PAT + r"\s+(weeks?|months?)"
-    m3 = re.search(pat, tl)
-    if m3:
-        v = _to_int(m3.group(1))
-        if v is not None:
-            return _to_weeks(v, m3.group(2))
+    for d in bare:
+        if d.digits and d.unit == "month" and "-" not in d.sep:
+            return d.weeks
+    # word-form (or any other unit): "two months", "six weeks"
+    for d in bare:
+        if d.sep.isspace():
+            return d.weeks
     return None
 
 
-# Treatment name patterns for conservative care matching
-_CARE_NAMES = [
-    r"physical therapy", r"pt\b", r"home exercises?",
-    r"chiropractic", r"chiro",
-]
-_CARE_PAT = "|".join(_CARE_NAMES)
-_UNIT_PAT = r"(weeks?|months?)"
-
-
-def _find_conservative_care_weeks(text: str) -> tuple[int | None, str | None]:
+def _find_conservative_care_weeks(text: str, mentions: Optional[List[DurationMention]] = None) -> tuple[int | None, str | None]:
     """
     Extract the maximum conservative care duration in weeks.
 
@@ -87,24 +226,11 @@ def _find_conservative_care_weeks(text: str) -> tuple[int | None, str | None]:
 
     Returns (max_weeks, matched_quote) or (None, None).
     """
-    tl = text.lower()
-    durations: list[tuple[int, str]] = []  # (weeks, matched_text)
-
-    # Pattern A: "<N> <unit> of <treatment>"
-    pat_a = _NUM_PAT + r"\s+" + _UNIT_PAT + r"\s+of\s+(" + _CARE_PAT + r")"
-    for m in re.finditer(pat_a, tl):
-        v = _to_int(m.group(1))
-        if v is not None:
-            weeks = _to_weeks(v, m.group(2))
-            durations.append((weeks, text[m.start():m.end()]))
-
-    # Pattern B: "<treatment> for <N> <unit>"
-    pat_b = r"(" + _CARE_PAT + r")\s+for\s+" + _NUM_PAT + r"\s+" + _UNIT_PAT
-    for m in re.finditer(pat_b, tl):
-        v = _to_int(m.group(2))
-        if v is not None:
-            weeks = _to_weeks(v, m.group(3))
-            durations.append((weeks, text[m.start():m.end()]))
+    if mentions is None:
+        mentions = scan_durations(text)
+    # "<N> <unit> of <treatment>" phrases rank ahead of "<treatment> for ..." on ties
+    durations = [(d.weeks, text[d.start:d.end]) for d in mentions if d.kind == "care_of"]
+    durations += [(d.weeks, text[d.start:d.end]) for d in mentions if d.kind == "care_for"]
 
     if not durations:
         return None, None
@@ -113,11 +239,42 @@ def _find_conservative_care_weeks(text: str) -> tuple[int | None, str | None]:
     best = max(durations, key=lambda x: x[0])
     return best[0], best[1]
 
-def _detect_treatments(text: str) -> List[str]:
-    tl = text.lower()
+
+@lru_cache(maxsize=64)
+def _weeks_quote_re(weeks: int) -> re.Pattern:
+    """Compiled "<weeks> week(s)" pattern used to locate the symptoms-duration quote."""
+    return re.compile(rf"{weeks}\s*weeks?")
+
+
+# Every keyword we look for, scanned once per note by _scan_keywords
+_ALL_KEYWORDS = sorted({kw for table in (TREATMENT_KEYWORDS, RED_FLAG_KEYWORDS) for kws in table.values() for kw in kws})
+
+
+def _scan_keywords(text_lower: str) -> Dict[str, int]:
+    """
+    Locate every treatment/red-flag keyword in the lower-cased note, one
+    str.find per keyword (about 40 scans, done once per note and shared by
+    the treatment and red flag detectors). Returns keyword -> offset of its
+    first occurrence (keywords that occur at all). Later occurrences are
+    only walked for negation checks.
+
+    str.find runs in C, so these scans beat a single pass of a pure-Python
+    Aho-Corasick or a lookahead alternation regex on long notes.
+    """
+    hits: Dict[str, int] = {}
+    for kw in _ALL_KEYWORDS:
+        idx = text_lower.find(kw)
+        if idx != -1:
+            hits[kw] = idx
+    return hits
+
+
+def _detect_treatments(text: str, hits: Optional[Dict[str, int]] = None) -> List[str]:
+    if hits is None:
+        hits = _scan_keywords(text.lower())
     found = []
     for k, kws in TREATMENT_KEYWORDS.items():
-        if any(kw in tl for kw in kws):
+        if any(kw in hits for kw in kws):
             found.append(k)
     return sorted(set(found))
 
@@ -137,13 +294,16 @@ def _is_negated(text_lower: str, match_start: int) -> bool:
             return True
     return False
 
-def _detect_red_flags(text: str) -> List[str]:
-    tl = text.lower()
+def _detect_red_flags(text: str, hits: Optional[Dict[str, int]] = None,
+                      text_lower: Optional[str] = None) -> List[str]:
+    tl = text.lower() if text_lower is None else text_lower
+    if hits is None:
+        hits = _scan_keywords(tl)
     flags = []
     for k, kws in RED_FLAG_KEYWORDS.items():
         flag_found = False
         for kw in kws:
-            idx = tl.find(kw)
+            idx = hits.get(kw, -1)
             while idx != -1:
                 if not _is_negated(tl, idx):
                     flag_found = True
@@ -156,6 +316,9 @@ def _detect_red_flags(text: str) -> List[str]:
             flags.append(k)
     return sorted(set(flags))
 
+def _span_at(text: str, idx: int, length: int) -> dict:
+    return {"source": "note", "start": idx, "end": idx + length, "quote": text[idx:idx+length]}
+
 def _evidence_span(text: str, needle: str) -> dict | None:
     """
     Return first occurrence span for a needle substring (case-insensitive).
@@ -165,23 +328,29 @@ def _evidence_span(text: str, needle: str) -> dict | None:
     idx = tl.find(nl)
     if idx == -1:
         return None
-    return {"source": "note", "start": idx, "end": idx + len(needle), "quote": text[idx:idx+len(needle)]}
+    return _span_at(text, idx, len(needle))
 
 def extract_facts_baseline(note_text: str, retrieved_policy: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # One duration sweep feeds both duration fields
+    mentions = scan_durations(note_text)
+
     # Symptoms duration (weeks) — naive
-    symptoms_weeks = _find_weeks(note_text)
+    symptoms_weeks = _find_weeks(note_text, mentions)
 
     # Conservative care weeks: flexible pattern matching
-    conservative_weeks, care_quote = _find_conservative_care_weeks(note_text)
+    conservative_weeks, care_quote = _find_conservative_care_weeks(note_text, mentions)
 
-    treatments = _detect_treatments(note_text)
-    red_flags = _detect_red_flags(note_text)
+    # One keyword sweep feeds treatments, red flags (with negation) and their evidence
+    note_lower = note_text.lower()
+    hits = _scan_keywords(note_lower)
+    treatments = _detect_treatments(note_text, hits)
+    red_flags = _detect_red_flags(note_text, hits, note_lower)
 
     # Build provenance map (baseline: coarse quotes only)
     evidence = {}
     if symptoms_weeks is not None:
         # try to find the specific phrase
-        m = re.search(rf"{symptoms_weeks}\s*weeks?", note_text.lower())
+        m = _weeks_quote_re(symptoms_weeks).search(note_lower)
         if m:
             start, end = m.span()
             evidence["symptoms_duration_weeks"] = [{"source":"note","start":start,"end":end,"quote":note_text[start:end]}]
@@ -195,9 +364,8 @@ def extract_facts_baseline(note_text: str, retrieved_policy: List[Dict[str, Any]
         for t in treatments:
             kws = TREATMENT_KEYWORDS.get(t, [])
             for kw in kws:
-                sp = _evidence_span(note_text, kw)
-                if sp:
-                    evs.append(sp)
+                if kw in hits:
+                    evs.append(_span_at(note_text, hits[kw], len(kw)))
         if evs:
             evidence["treatments"] = evs
     if red_flags:
@@ -205,9 +373,8 @@ def extract_facts_baseline(note_text: str, retrieved_policy: List[Dict[str, Any]
         for f in red_flags:
             kws = RED_FLAG_KEYWORDS.get(f, [])
             for kw in kws:
-                sp = _evidence_span(note_text, kw)
-                if sp:
-                    evs.append(sp)
+                if kw in hits:
+                    evs.append(_span_at(note_text, hits[kw], len(kw)))
         if evs:
             evidence["red_flags"] = evs
 
@@ -6,42 +6,285 @@ Implements:
 - Refusal guardrail for clinical decision questions
 - Evidence span validation
 - Fallback to baseline on errors
+- Batched extraction over parallel model contexts
+- Reuse of the fixed prompt prefix's KV cache across notes
+- JSON-schema constrained decoding (EXTRACTION_SCHEMA)
+- Streaming generation that stops once the JSON object closes
 """
+import hashlib
+import contextvars
 import json
+import os
+import pickle
+import queue
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Sequence, Tuple
 
 from .extraction_baseline import (
     extract_facts_baseline, _detect_red_flags, _detect_treatments,
     _find_conservative_care_weeks,
-    RED_FLAG_KEYWORDS, TREATMENT_KEYWORDS, _evidence_span, _is_negated,
+    RED_FLAG_KEYWORDS, TREATMENT_KEYWORDS, _is_negated, _span_at,
 )
-from .prompt_template import PROMPT_TEMPLATE
+from . import timing
+from .cache import cache_root
+from .jsonio import ExtractedFacts, check_shape
+from .note_index import note_index
+from .runtime_profile import active_profile
+from .prompt_template import EVIDENCE_MAX_SPANS, EXTRACTION_SCHEMA, PROMPT_INSTRUCTIONS, PROMPT_TEMPLATE
 
 # -----------------------------------------------------------------------------
 # Model Configuration
 # -----------------------------------------------------------------------------
-MODEL_PATH = Path(__file__).parent.parent / "models" / "google_medgemma-4b-it-Q4_K_M.gguf"
-_model = None  # Lazy-loaded singleton
+# Model file, context size, threads, batch and flash attention come from the
+# runtime profile (runtime_profile.py)
+SYSTEM_PROMPT = "You are a medical document extraction assistant. You ONLY output valid JSON, never code or explanations."
+# Output is grammar-constrained bare JSON, so no budget goes to markdown/prose
+MAX_TOKENS = 768
+_model = None  # Lazy-loaded singleton (always _replicas[0] once loaded)
+_replicas: List[Any] = []  # Contexts for extract_facts_llm_batch; only ever grows
+_replicas_cap: Optional[int] = None  # Set when loading another context failed
+_replica_threads: List[int] = []  # n_threads each context in _replicas was loaded with
+_context_locks: Dict[int, threading.Lock] = {}  # id(context) -> lock held by _generate
+_load_lock = threading.Lock()  # Callers racing to load (or grow) _replicas load once
+_load_report: Optional[Dict[str, Any]] = None  # Last model load in this process (see _note_load)
+
+
+def _load_model(n_threads: Optional[int] = None):
+    """
+    Load one MedGemma context with the active runtime profile (n_threads
+    overrides the profile's). Weights are mmap'd, so replicas share their pages.
+    """
+    from llama_cpp import Llama
+    kwargs = active_profile().llama_kwargs()
+    if n_threads:
+        kwargs["n_threads"] = n_threads
+    return Llama(**kwargs, use_mmap=True, verbose=False)
+
+
+def context_threads(n_contexts: int, n_threads: Optional[int] = None) -> int:
+    """Threads per context: n_threads, else the profile's, else an equal share of the CPUs."""
+    return n_threads or active_profile().n_threads or max(1, (os.cpu_count() or 1) // n_contexts)
+
+
+def _memory_mb() -> Dict[str, Optional[float]]:
+    """
+    Resident memory of this process and the file-backed part of it (mmap'd
+    weights, shared with every other process mapping the same GGUF).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            resident, shared = (int(x) for x in f.read().split()[1:3])
+    except (OSError, ValueError):
+        return {"rss_mb": None, "shared_mb": None}
+    page_mb = os.sysconf("SC_PAGE_SIZE") / 2**20
+    return {"rss_mb": round(resident * page_mb, 1), "shared_mb": round(shared * page_mb, 1)}
+
+
+def _note_load(t0: float, contexts: int, n_threads: Optional[int]) -> None:
+    global _load_report
+    _load_report = {
+        "pid": os.getpid(),
+        "contexts": contexts,
+        "n_threads": n_threads,
+        "load_s": round(time.perf_counter() - t0, 3),
+        **_memory_mb(),
+    }
+    r = _load_report
+    print(f"[PA-Trace] Model loaded: {contexts} context(s) x {n_threads or 'default'} threads in {r['load_s']:.1f}s "
+          f"(pid {r['pid']}, RSS {r['rss_mb']} MB, {r['shared_mb']} MB shared)")
+
+
+def model_load_report() -> Optional[Dict[str, Any]]:
+    """The last model load in this process: pid, contexts, threads, seconds, RSS/shared MB."""
+    return _load_report
+
+
+def _get_model(n_threads: Optional[int] = None):
+    """Lazy-load MedGemma model (singleton). n_threads applies only to the first load."""
+    replicas = _get_replicas(1, n_threads)
+    return replicas[0] if replicas else None
+
+
+@lru_cache(maxsize=None)
+def _get_grammar():
+    """llama.cpp grammar for EXTRACTION_SCHEMA (stateless, shared by all contexts)."""
+    try:
+        from llama_cpp import LlamaGrammar
+        return LlamaGrammar.from_json_schema(json.dumps(EXTRACTION_SCHEMA), verbose=False)
+    except Exception as e:
+        print(f"[WARN] JSON-schema grammar unavailable ({e}); decoding unconstrained")
+        return None
 
 
-def _get_model():
-    """Lazy-load MedGemma model (singleton)."""
-    global _model
-    if _model is None:
+def _get_replicas(n: int, n_threads: Optional[int] = None) -> List[Any]:
+    """
+    At least n model contexts for parallel extraction (fewer if loading
+    failed), each with its own KV cache. Contexts are loaded once and kept:
+    a later call for more adds the missing ones, a call for fewer returns
+    them all, so small batches never reload anything. The first context is
+    the _get_model singleton.
+
+    Every context runs context_threads(n, n_threads) threads. A context's
+    thread count is fixed when it is loaded, so if growing the set changes
+    that share (e.g. the 1-context singleton had all the CPUs), the loaded
+    contexts are rebuilt at the new share instead of oversubscribing the
+    machine. That only happens on growth, never for a smaller batch.
+    """
+    with _load_lock:
+        return _load_replicas(n, n_threads)
+
+
+def _load_replicas(n: int, n_threads: Optional[int]) -> List[Any]:
+    global _model, _replicas_cap
+    want = n if _replicas_cap is None else min(n, _replicas_cap)
+    if len(_replicas) < want:
+        n_threads = context_threads(n, n_threads)
+        if any(t != n_threads for t in _replica_threads):
+            _replicas.clear()
+            _replica_threads.clear()
+            _model = None
+        t0 = time.perf_counter()
         try:
-            from llama_cpp import Llama
-            _model = Llama(
-                model_path=str(MODEL_PATH),
-                n_gpu_layers=-1,  # Offload all layers to GPU
-                n_ctx=4096,       # Context window
-                verbose=False,
-            )
+            while len(_replicas) < want:
+                _replicas.append(_load_model(n_threads=n_threads))
+                _replica_threads.append(n_threads)
         except Exception as e:
             print(f"[WARN] Failed to load MedGemma model: {e}")
+            # Keep what loaded; don't retry (and re-fail) on every batch
+            _replicas_cap = len(_replicas)
+        if _replicas:
+            _model = _replicas[0]
+            _note_load(t0, len(_replicas), n_threads)
+    return _replicas
+
+
+def preload_model(replicas: int = 1, n_threads: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Load the contexts later extractions will use (_get_replicas) and the
+    prompt prefix state, so the first case doesn't pay for a cold load.
+    Returns the load report, with "ok" False if the model could not be
+    loaded.
+    """
+    models = _get_replicas(replicas, n_threads)
+    if not models:
+        return {"pid": os.getpid(), "ok": False}
+    try:
+        _get_grammar()
+        _restore_prefix(models[0])
+    except Exception as e:
+        print(f"[WARN] Prompt prefix warm-up failed: {e}")
+    return {**(_load_report or {}), "ok": True}
+
+
+# -----------------------------------------------------------------------------
+# Prompt Prefix Cache
+# -----------------------------------------------------------------------------
+# The system message + PROMPT_INSTRUCTIONS render to the same leading tokens
+# for every note. Their llama.cpp state is computed once, kept in memory and
+# (unless PREFIX_STATE_DIR is None) saved to disk for the next process, then
+# restored into any context that does not already start with it. Within one
+# context llama.cpp keeps the matching prefix of the previous prompt by itself.
+PREFIX_STATE_DIR: Optional[Path] = cache_root() / "prefix_state"
+# Two throwaway inputs that differ from their first character on
+_PRIMING_INPUTS = (
+    ("Patient reports low back pain.", []),
+    ("Follow-up visit, no new complaints.", [{"chunk_id": "priming", "text": "Priming chunk."}]),
+)
+_prefix_state = None  # (LlamaState, n_prefix_tokens), shared by all contexts
+_prefix_tried = False
+_prefix_lock = threading.Lock()
+
+
+def _common_prefix_len(a: Sequence[int], b: Sequence[int]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+def _context_tokens(model) -> List[int]:
+    """Tokens currently held in the model's KV cache."""
+    return model.input_ids[:model.n_tokens].tolist()
+
+
+def _prefix_state_path() -> Path:
+    import llama_cpp
+    profile = active_profile()
+    st = profile.model_file.stat()
+    h = hashlib.sha256()
+    for part in (profile.model_file.name, st.st_size, st.st_mtime_ns, profile.n_ctx, profile.flash_attn,
+                 llama_cpp.__version__, SYSTEM_PROMPT, PROMPT_INSTRUCTIONS):
+        h.update(repr(part).encode("utf-8") + b"\0")
+    return PREFIX_STATE_DIR / f"{h.hexdigest()[:32]}.pkl"
+
+
+def _prime_prefix(model):
+    """
+    Evaluate the fixed prefix on `model` and snapshot it. Two throwaway cases
+    are run through the real chat template; the tokens they share are the
+    prefix, wherever the template puts the system message.
+    """
+    runs = []
+    for note, policy in _PRIMING_INPUTS:
+        model.create_chat_completion(messages=_build_messages(note, policy), max_tokens=1, temperature=0.0)
+        runs.append(_context_tokens(model))
+    n_prefix = _common_prefix_len(*runs)
+    state = model.save_state()
+    # Without logits_all only the last row of scores is meaningful, and
+    # generate() re-evaluates after a restore anyway; load_state broadcasts it.
+    state.scores = state.scores[-1:].copy()
+    return state, n_prefix
+
+
+def _get_prefix_state(model):
+    """Prefix state from memory, then disk, else primed on `model`. None if unavailable."""
+    global _prefix_state, _prefix_tried
+    with _prefix_lock:
+        if _prefix_tried:
+            return _prefix_state
+        _prefix_tried = True
+        path = _prefix_state_path() if PREFIX_STATE_DIR is not None else None
+        if path is not None and path.exists():
+            try:
+                with open(path, "rb") as f:
+                    _prefix_state = pickle.load(f)
+                return _prefix_state
+            except Exception as e:
+                print(f"[WARN] Ignoring unreadable prompt prefix cache {path}: {e}")
+        try:
+            _prefix_state = _prime_prefix(model)
+        except Exception as e:
+            print(f"[WARN] Failed to prime prompt prefix cache: {e}")
             return None
-    return _model
+        if path is not None:
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                # Per-process temp name: preloading pool workers may prime at once
+                tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+                with open(tmp, "wb") as f:
+                    pickle.dump(_prefix_state, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp, path)
+            except OSError as e:
+                print(f"[WARN] Could not save prompt prefix cache: {e}")
+        return _prefix_state
+
+
+def _restore_prefix(model) -> None:
+    """Load the cached prefix into `model` unless its KV cache already starts with it."""
+    cached = _get_prefix_state(model)
+    if cached is None:
+        return
+    state, n_prefix = cached
+    held = _context_tokens(model)[:n_prefix]
+    if _common_prefix_len(held, state.input_ids[:n_prefix].tolist()) < n_prefix:
+        model.load_state(state)
 
 
 # -----------------------------------------------------------------------------
@@ -90,6 +333,44 @@ def _parse_json_response(raw_output: str) -> Optional[Dict[str, Any]]:
     except json.JSONDecodeError:
         return None
 
+class _ObjectEndTracker:
+    """
+    Incremental scan of streamed model text for the end of the top-level
+    JSON object: brace/bracket depth, skipping string contents. Text before
+    the first "{" (e.g. a markdown fence) is ignored.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escape = False
+
+    def feed(self, chunk: str) -> int:
+        """Offset in chunk just past the closing brace, or -1 if still open."""
+        for i, c in enumerate(chunk):
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+            elif not self.started:
+                if c == "{":
+                    self.started = True
+                    self.depth = 1
+            elif c == '"':
+                self.in_string = True
+            elif c in "{[":
+                self.depth += 1
+            elif c in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    return i + 1
+        return -1
+
+
 # -----------------------------------------------------------------------------
 # Evidence Validation
 # -----------------------------------------------------------------------------
@@ -122,18 +403,16 @@ def _find_quote_in_text(quote: str, text: str) -> tuple[int, str]:
     to prevent false positives (e.g., "pt" in "symptoms").
     Returns (position, matched_text) or (-1, "") if not found.
     """
+    index = note_index(text)
     # For short quotes (single token), use word-boundary matching
     if len(quote.split()) == 1:
-        pattern = r'\b' + re.escape(quote) + r'\b'
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            return match.start(), text[match.start():match.end()]
+        idx = index.find_word(quote)
+        if idx != -1:
+            return idx, text[idx:idx + len(quote)]
         return -1, ""
     
     # For multi-token quotes, use case-insensitive substring search
-    text_lower = text.lower()
-    quote_lower = quote.lower()
-    idx = text_lower.find(quote_lower)
+    idx = index.find(quote)
     if idx != -1:
         # Return the actual text (preserving original case)
         return idx, text[idx:idx + len(quote)]
@@ -141,6 +420,12 @@ def _find_quote_in_text(quote: str, text: str) -> tuple[int, str]:
     return -1, ""
 
 
+def _note_span(note_text: str, needle: str) -> Optional[Dict[str, Any]]:
+    """extraction_baseline._evidence_span, through the note's shared index."""
+    idx = note_index(note_text).find(needle)
+    return _span_at(note_text, idx, len(needle)) if idx != -1 else None
+
+
 def _validate_evidence_spans(parsed: Dict[str, Any], note_text: str) -> Dict[str, Any]:
     """
     Validate that all evidence quotes are actual verbatim substrings of the note.
@@ -149,6 +434,7 @@ def _validate_evidence_spans(parsed: Dict[str, Any], note_text: str) -> Dict[str
     - Uses word-boundary matching for single-token quotes
     - Uses substring matching for multi-token quotes
     - Recalculates start/end offsets from the actual match position
+    - Drops duplicate spans and keeps at most EVIDENCE_MAX_SPANS per field
     
     Invalid evidence -> field nulled out, added to missing_evidence.
     """
@@ -179,7 +465,9 @@ def _validate_evidence_spans(parsed: Dict[str, Any], note_text: str) -> Dict[str
             
             # Find actual position in note text
             idx, matched_text = _find_quote_in_text(quote, note_text)
-            if idx != -1:
+            if idx != -1 and not any(sp["start"] == idx and sp["quote"] == matched_text for sp in valid_evidence):
+                if len(valid_evidence) >= EVIDENCE_MAX_SPANS:
+                    break
                 valid_evidence.append({
                     "source": "note",
                     "start": idx,
@@ -232,7 +520,7 @@ def _boost_red_flags_from_baseline(parsed: Dict[str, Any], note_text: str) -> Di
     for flag in missing_flags:
         keywords = RED_FLAG_KEYWORDS.get(flag, [])
         for kw in keywords:
-            span = _evidence_span(note_text, kw)
+            span = _note_span(note_text, kw)
             if span:
                 existing_rf_evidence.append(span)
                 break  # one evidence span per flag is enough
@@ -263,7 +551,7 @@ def _boost_conservative_care_from_baseline(parsed: Dict[str, Any], note_text: st
     # Synthesize evidence span
     if matched_quote:
         evidence = parsed.get("evidence", {})
-        span = _evidence_span(note_text, matched_quote)
+        span = _note_span(note_text, matched_quote)
         if span:
             evidence["conservative_care_weeks"] = [span]
             parsed["evidence"] = evidence
@@ -326,7 +614,7 @@ def _boost_evidence_spans_from_baseline(parsed: Dict[str, Any], note_text: str)
     Respects negation for red flags (won't highlight "Denies fever").
     """
     evidence = parsed.get("evidence", {})
-    note_lower = note_text.lower()
+    index = note_index(note_text)
 
     # --- Treatments: add spans for all matching keywords ---
     treatments = parsed.get("treatments", [])
@@ -336,7 +624,7 @@ def _boost_evidence_spans_from_baseline(parsed: Dict[str, Any], note_text: str)
         for treat in treatments:
             for kw in TREATMENT_KEYWORDS.get(treat, []):
                 if kw.lower() not in existing_quotes:
-                    span = _evidence_span(note_text, kw)
+                    span = _note_span(note_text, kw)
                     if span:
                         extra_spans.append(span)
                         existing_quotes.add(kw.lower())
@@ -351,12 +639,10 @@ def _boost_evidence_spans_from_baseline(parsed: Dict[str, Any], note_text: str)
         for flag in red_flags:
             for kw in RED_FLAG_KEYWORDS.get(flag, []):
                 if kw.lower() not in existing_quotes:
-                    idx = note_lower.find(kw.lower())
-                    if idx != -1 and not _is_negated(note_lower, idx):
-                        span = _evidence_span(note_text, kw)
-                        if span:
-                            extra_spans.append(span)
-                            existing_quotes.add(kw.lower())
+                    idx = index.find(kw)
+                    if idx != -1 and not _is_negated(index.lower, idx):
+                        extra_spans.append(_span_at(note_text, idx, len(kw)))
+                        existing_quotes.add(kw.lower())
         if extra_spans:
             evidence["red_flags"] = list(evidence.get("red_flags", [])) + extra_spans
 
@@ -367,6 +653,157 @@ def _boost_evidence_spans_from_baseline(parsed: Dict[str, Any], note_text: str)
 # -----------------------------------------------------------------------------
 # Main Extraction Function
 # -----------------------------------------------------------------------------
+def _fallback_baseline(note_text: str, retrieved_policy: List[Dict[str, Any]]) -> Dict[str, Any]:
+    result = extract_facts_baseline(note_text, retrieved_policy)
+    result["extraction_mode"] = "llm_fallback_baseline"
+    return result
+
+
+def _build_messages(note_text: str, retrieved_policy: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """Chat messages for one note (proper Gemma format via the model's chat template)."""
+    user_message = PROMPT_TEMPLATE.format(
+        note_text=note_text,
+        policy_chunks_json=json.dumps(retrieved_policy, indent=2),
+    )
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_message},
+    ]
+
+
+def _context_lock(model) -> threading.Lock:
+    """The lock serialising generations on one llama.cpp context."""
+    # dict.setdefault is atomic, so racing callers get the same lock
+    return _context_locks.setdefault(id(model), threading.Lock())
+
+
+def _generate(model, messages: List[Dict[str, str]], max_tokens: int = MAX_TOKENS) -> Tuple[str, Dict[str, int]]:
+    """
+    Stream one chat completion, stopping as soon as the top-level JSON object
+    closes (trailing padding/text is never decoded). Returns (raw output,
+    token stats). Holds the context's lock throughout: a llama.cpp context
+    runs one generation at a time, whichever thread, event loop or server
+    request calls in.
+    """
+    with _context_lock(model):
+        return _generate_locked(model, messages, max_tokens)
+
+
+def _generate_locked(model, messages: List[Dict[str, str]], max_tokens: int) -> Tuple[str, Dict[str, int]]:
+    with timing.span("llm.prefix_restore"):
+        _restore_prefix(model)
+    before = _context_tokens(model)
+    stream = model.create_chat_completion(
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=0.1,  # Low temperature for consistent output
+        grammar=_get_grammar(),
+        stream=True,
+    )
+    tracker = _ObjectEndTracker()
+    parts: List[str] = []
+    prompt_tokens = None
+    stopped_early = False
+    t0 = t_first = time.perf_counter()
+    try:
+        for chunk in stream:
+            if prompt_tokens is None:
+                # The first chunk follows prompt eval + the first sample
+                prompt_tokens = model.n_tokens
+                t_first = time.perf_counter()
+            text = chunk["choices"][0]["delta"].get("content")
+            if not text:
+                continue
+            end = tracker.feed(text)
+            if end != -1:
+                parts.append(text[:end])
+                stopped_early = True
+                break
+            parts.append(text)
+    finally:
+        stream.close()
+    timing.record("llm.prompt_eval", t_first - t0)
+    timing.record("llm.decode", time.perf_counter() - t_first)
+
+    context = _context_tokens(model)
+    prompt_tokens = prompt_tokens if prompt_tokens is not None else len(context)
+    # llama.cpp re-evaluates at least the last prompt token
+    reused = min(_common_prefix_len(before, context), max(prompt_tokens - 1, 0))
+    stats = {
+        "prompt_tokens": prompt_tokens,
+        "prompt_tokens_reused": reused,
+        # the last sampled token is never fed back, hence +1
+        "completion_tokens": max(len(context) - prompt_tokens + 1, 0) if parts else 0,
+        "stopped_early": stopped_early,
+    }
+    return "".join(parts), stats
+
+
+def _postprocess(raw_output: str, note_text: str, retrieved_policy: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Parse model output, validate evidence and apply the baseline safety nets."""
+    # 1. Parse JSON response
+    with timing.span("llm.parse"):
+        parsed = _parse_json_response(raw_output)
+    if parsed is None:
+        print(f"[WARN] Failed to parse JSON from model output, falling back to baseline")
+        return _fallback_baseline(note_text, retrieved_policy)
+
+    # 2. Validate evidence spans
+    with timing.span("llm.validate"):
+        validated = _validate_evidence_spans(parsed, note_text)
+
+    # 3. Boost red flags from baseline (safety net for missed detections)
+    with timing.span("llm.boost_red_flags"):
+        validated = _boost_red_flags_from_baseline(validated, note_text)
+
+    # 4. Boost conservative care from baseline (safety net for missed detections)
+    with timing.span("llm.boost_conservative_care"):
+        validated = _boost_conservative_care_from_baseline(validated, note_text)
+
+    # 5. Boost treatments from baseline (safety net for missed detections)
+    with timing.span("llm.boost_treatments"):
+        validated = _boost_treatments_from_baseline(validated, note_text)
+
+    # 6. Boost evidence spans from baseline (fill highlight gaps)
+    with timing.span("llm.boost_evidence_spans"):
+        validated = _boost_evidence_spans_from_baseline(validated, note_text)
+
+    # 7. Ensure required fields exist
+    validated.setdefault("symptoms_duration_weeks", None)
+    validated.setdefault("conservative_care_weeks", None)
+    validated.setdefault("treatments", [])
+    validated.setdefault("red_flags", [])
+    validated.setdefault("red_flags_present", bool(validated.get("red_flags")))
+    validated.setdefault("evidence", {})
+    validated.setdefault("missing_evidence", [])
+    validated["extraction_mode"] = "llm"
+
+    # 8. Reject values the checklist can't use (e.g. "8" for a week count)
+    try:
+        check_shape(validated, ExtractedFacts, "llm output")
+    except ValueError as e:
+        print(f"[WARN] {e}, falling back to baseline")
+        return _fallback_baseline(note_text, retrieved_policy)
+
+    return validated
+
+
+def _extract_with(model, note_text: str, retrieved_policy: List[Dict[str, Any]]) -> Dict[str, Any]:
+    try:
+        with timing.span("llm.prompt_build"):
+            messages = _build_messages(note_text, retrieved_policy)
+        raw_output, stats = _generate(model, messages)
+    except Exception as e:
+        print(f"[WARN] Model inference failed: {e}, falling back to baseline")
+        return _fallback_baseline(note_text, retrieved_policy)
+    print(f"[PA-Trace] Prompt tokens: {stats['prompt_tokens']} "
+          f"({stats['prompt_tokens_reused']} reused from cached prefix) | "
+          f"Completion tokens: {stats['completion_tokens']}")
+    result = _postprocess(raw_output, note_text, retrieved_policy)
+    result["llm_stats"] = stats
+    return result
+
+
 def extract_facts_llm(note_text: str, retrieved_policy: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
     Extract structured facts using MedGemma via llama-cpp-python.
@@ -382,67 +819,84 @@ def extract_facts_llm(note_text: str, retrieved_policy: List[Dict[str, Any]]) ->
         return refusal
     
     # 2. Load model
-    model = _get_model()
+    with timing.span("llm.model_load"):
+        model = _get_model()
     if model is None:
         print("[WARN] Model not available, falling back to baseline")
-        result = extract_facts_baseline(note_text, retrieved_policy)
-        result["extraction_mode"] = "llm_fallback_baseline"
-        return result
-    
-    # 3. Build prompt using chat format
-    user_message = PROMPT_TEMPLATE.format(
-        note_text=note_text,
-        policy_chunks_json=json.dumps(retrieved_policy, indent=2),
-    )
+        return _fallback_baseline(note_text, retrieved_policy)
     
-    # 4. Call MedGemma using chat completion (proper Gemma format)
-    try:
-        response = model.create_chat_completion(
-            messages=[
-                {"role": "system", "content": "You are a medical document extraction assistant. You ONLY output valid JSON, never code or explanations."},
-                {"role": "user", "content": user_message}
-            ],
-            max_tokens=1024,
-            temperature=0.1,  # Low temperature for consistent output
-        )
-        raw_output = response["choices"][0]["message"]["content"]
-    except Exception as e:
-        print(f"[WARN] Model inference failed: {e}, falling back to baseline")
-        result = extract_facts_baseline(note_text, retrieved_policy)
-        result["extraction_mode"] = "llm_fallback_baseline"
-        return result
-    
-    # 5. Parse JSON response
-    parsed = _parse_json_response(raw_output)
-    if parsed is None:
-        print(f"[WARN] Failed to parse JSON from model output, falling back to baseline")
-        result = extract_facts_baseline(note_text, retrieved_policy)
-        result["extraction_mode"] = "llm_fallback_baseline"
-        return result
-    
-    # 6. Validate evidence spans
-    validated = _validate_evidence_spans(parsed, note_text)
-    
-    # 7. Boost red flags from baseline (safety net for missed detections)
-    validated = _boost_red_flags_from_baseline(validated, note_text)
+    # 3. Generate, then validate + boost
+    return _extract_with(model, note_text, retrieved_policy)
 
-    # 8. Boost conservative care from baseline (safety net for missed detections)
-    validated = _boost_conservative_care_from_baseline(validated, note_text)
 
-    # 9. Boost treatments from baseline (safety net for missed detections)
-    validated = _boost_treatments_from_baseline(validated, note_text)
+# -----------------------------------------------------------------------------
+# Batched Extraction
+# -----------------------------------------------------------------------------
+DEFAULT_LLM_PARALLEL = 2
 
-    # 10. Boost evidence spans from baseline (fill highlight gaps)
-    validated = _boost_evidence_spans_from_baseline(validated, note_text)
-    
-    # 10. Ensure required fields exist
-    validated.setdefault("symptoms_duration_weeks", None)
-    validated.setdefault("conservative_care_weeks", None)
-    validated.setdefault("treatments", [])
-    validated.setdefault("red_flags", [])
-    validated.setdefault("red_flags_present", bool(validated.get("red_flags")))
-    validated.setdefault("evidence", {})
-    validated.setdefault("missing_evidence", [])
-    validated["extraction_mode"] = "llm"
-    
-    return validated
+
+def extract_facts_llm_batch(notes: Sequence[str], retrieved_policies: Sequence[List[Dict[str, Any]]],
+                            n_parallel: int = DEFAULT_LLM_PARALLEL,
+                            n_threads: Optional[int] = None,
+                            timings: Optional[List[Dict[str, float]]] = None) -> List[Dict[str, Any]]:
+    """
+    extract_facts_llm over many notes, results in input order.
+
+    Notes are drained by n_parallel threads from a queue of model replicas
+    (llama.cpp releases the GIL while decoding, and the replicas share the
+    mmap'd weights), so a CPU box runs n_parallel generations at once.
+    Refusal, validation and baseline boosts are applied per note exactly as
+    in extract_facts_llm. n_threads is per context (default: an equal share
+    of the CPUs), used when the contexts are first loaded.
+
+    If a timings list is given, it is filled with one {span: seconds} dict
+    per note, holding the spans the note recorded on its replica thread
+    (extract, llm.*). The group's model load goes to the first note that
+    reaches the model, like the first case of a sequential run.
+    """
+    assert len(notes) == len(retrieved_policies), "one retrieved_policy per note"
+    results: List[Optional[Dict[str, Any]]] = [None] * len(notes)
+    spans: List[Dict[str, float]] = [{} for _ in notes]
+    if timings is not None:
+        timings[:] = spans
+    todo = []
+    for i, note_text in enumerate(notes):
+        refusal = _check_refusal(note_text)
+        if refusal:
+            results[i] = refusal
+        else:
+            todo.append(i)
+    if not todo:
+        return results
+
+    # Load at the requested size even for a small batch: the contexts are kept
+    # for the next one, and only as many threads run as there are notes
+    with timing.collect(spans[todo[0]]), timing.span("llm.model_load"):
+        replicas = _get_replicas(max(1, n_parallel), n_threads)
+    if not replicas:
+        print("[WARN] Model not available, falling back to baseline")
+        for i in todo:
+            results[i] = _fallback_baseline(notes[i], retrieved_policies[i])
+        return results
+
+    free: "queue.Queue[Any]" = queue.Queue()
+    for m in replicas:
+        free.put(m)
+
+    def timed_extract(i: int, model) -> Dict[str, Any]:
+        with timing.collect(spans[i]), timing.span("extract"):
+            return _extract_with(model, notes[i], retrieved_policies[i])
+
+    def work(i: int) -> Dict[str, Any]:
+        model = free.get()
+        try:
+            # Pool threads don't inherit the caller's context: give each note
+            # a fresh copy whose collection is its own spans dict
+            return contextvars.copy_context().run(timed_extract, i, model)
+        finally:
+            free.put(model)
+
+    with ThreadPoolExecutor(max_workers=min(len(replicas), len(todo))) as pool:
+        for i, result in zip(todo, pool.map(work, todo)):
+            results[i] = result
+    return results
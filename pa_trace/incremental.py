@@ -0,0 +1,190 @@
+"""
+Stage-level memoization for re-runs into the same output folder (--incremental).
+
+Each case folder keeps a manifest (.stages.json) with, per stage, a key over
+the stage's inputs plus the source of the code implementing it, and the
+stage's output:
+
+  retrieval   query, policy store contents, retriever   retrieval.py, policy_store.py, policy_index.py
+  extraction  mode, note, retrieved chunks               extraction_key (extractor source, prompt, model)
+  checklist   extracted facts                            checklist.py
+  assemble    case, chunks, facts, checklist, outputs    assemble.py, templates/
+
+A stage whose key matches is skipped and its recorded output reused. Editing
+build_checklist re-runs the checklist, and the bundle only for cases whose
+checklist actually changed; a case added to cases/ is the only one that
+runs. Keys hash content, so touching a file without changing it is free.
+"""
+import hashlib
+import os
+import weakref
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import timing
+from .assemble import OUTPUT_FILES, write_packet_bundle
+from .cache import CACHEABLE_MODES, extraction_key
+from .checklist import build_checklist
+from .jsonio import ExtractedFacts, check_shape, dumps, read_json
+from .pipeline import _default_store, extract_facts, load_case, report_case, retrieval_query, write_timings
+from .policy_store import PolicyStore
+from .retrieval import retrieve
+
+MANIFEST_NAME = ".stages.json"
+
+# Modules (and templates) each stage's output depends on, relative to the package
+STAGE_SOURCES = {
+    "retrieval": ["retrieval.py", "policy_store.py", "policy_index.py"],
+    "checklist": ["checklist.py"],
+    "assemble": ["assemble.py", "templates/*"],
+}
+
+_PKG_DIR = Path(__file__).resolve().parent
+
+Manifest = Dict[str, Dict[str, Any]]
+
+
+@lru_cache(maxsize=None)
+def _source_fingerprint(stage: str) -> str:
+    h = hashlib.sha256()
+    for pattern in STAGE_SOURCES[stage]:
+        for path in sorted(_PKG_DIR.glob(pattern)):
+            h.update(path.relative_to(_PKG_DIR).as_posix().encode("utf-8"))
+            h.update(path.read_bytes())
+    return h.hexdigest()
+
+
+def _stage_key(stage: str, *inputs: Any) -> str:
+    h = hashlib.sha256(_source_fingerprint(stage).encode("ascii"))
+    h.update(dumps(list(inputs)).encode("utf-8"))
+    return h.hexdigest()
+
+
+# Content hash per store object; file-backed stores hash their file once
+_store_hashes: "weakref.WeakKeyDictionary[Any, str]" = weakref.WeakKeyDictionary()
+
+
+def _store_fingerprint(policy_store: PolicyStore) -> str:
+    fp = _store_hashes.get(policy_store)
+    if fp is None:
+        path = getattr(policy_store, "path", None)
+        if path is not None:
+            fp = hashlib.sha256(Path(path).read_bytes()).hexdigest()
+        else:
+            fp = hashlib.sha256(dumps(list(policy_store)).encode("utf-8")).hexdigest()
+        _store_hashes[policy_store] = fp
+    return fp
+
+
+def load_manifest(out_dir: Path) -> Manifest:
+    try:
+        manifest = read_json(out_dir / MANIFEST_NAME)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+
+def save_manifest(out_dir: Path, manifest: Manifest) -> None:
+    path = out_dir / MANIFEST_NAME
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(dumps(manifest), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _recorded(manifest: Manifest, stage: str, key: str) -> Tuple[bool, Any]:
+    entry = manifest.get(stage)
+    if isinstance(entry, dict) and entry.get("key") == key:
+        return True, entry.get("value")
+    return False, None
+
+
+def memo_retrieve(manifest: Manifest, case: Dict[str, Any], policy_store: Optional[PolicyStore] = None,
+                  retriever: str = "auto") -> List[Dict[str, Any]]:
+    with timing.span("policy_load"):
+        policy_store = _default_store(policy_store)
+    query = retrieval_query(case)
+    key = _stage_key("retrieval", query, retriever, _store_fingerprint(policy_store))
+    hit, retrieved = _recorded(manifest, "retrieval", key)
+    if not hit:
+        with timing.span("retrieval"):
+            retrieved = retrieve(policy_store, query=query, k=3, method=retriever)
+        manifest["retrieval"] = {"key": key, "value": retrieved}
+    return retrieved
+
+
+def recorded_extraction(manifest: Manifest, mode: str, case: Dict[str, Any],
+                        retrieved: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """The manifest's extraction for these inputs, or None if it must run."""
+    hit, extracted = _recorded(manifest, "extraction", extraction_key(mode, case.get("note_text", ""), retrieved))
+    return check_shape(extracted, ExtractedFacts, "recorded extraction") if hit else None
+
+
+def record_extraction(manifest: Manifest, mode: str, case: Dict[str, Any], retrieved: List[Dict[str, Any]],
+                      extracted: Dict[str, Any]) -> None:
+    # A fallback after a model error is not a result to keep: leave it keyless so it re-runs
+    key = None
+    if extracted.get("extraction_mode") in CACHEABLE_MODES:
+        key = extraction_key(mode, case.get("note_text", ""), retrieved)
+    manifest["extraction"] = {"key": key, "value": extracted}
+
+
+def memo_extract(manifest: Manifest, case: Dict[str, Any], retrieved: List[Dict[str, Any]], mode: str = "baseline",
+                 use_cache: bool = True, use_server: bool = False) -> Dict[str, Any]:
+    extracted = recorded_extraction(manifest, mode, case, retrieved)
+    if extracted is None:
+        extracted = extract_facts(case.get("note_text", ""), retrieved, mode=mode, use_cache=use_cache,
+                                  use_server=use_server)
+        record_extraction(manifest, mode, case, retrieved, extracted)
+    return extracted
+
+
+def memo_finish(manifest: Manifest, case: Dict[str, Any], retrieved: List[Dict[str, Any]],
+                extracted: Dict[str, Any], out_dir: Path, outputs: str = "full") -> Dict[str, Any]:
+    """
+    finish_case, skipping the checklist and/or the bundle writes when their
+    inputs are unchanged, then saving the manifest.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    key = _stage_key("checklist", extracted)
+    hit, checklist = _recorded(manifest, "checklist", key)
+    if not hit:
+        with timing.span("checklist"):
+            checklist = build_checklist(extracted)
+        manifest["checklist"] = {"key": key, "value": checklist}
+
+    bundle = {
+        "case": case,
+        "retrieved_policy": retrieved,
+        "extracted": extracted,
+        "checklist": checklist,
+    }
+    key = _stage_key("assemble", case, retrieved, extracted, checklist, outputs)
+    hit, _ = _recorded(manifest, "assemble", key)
+    if not hit or not all((out_dir / name).exists() for name in OUTPUT_FILES[outputs]):
+        write_packet_bundle(bundle=bundle, out_dir=out_dir, outputs=outputs)
+        manifest["assemble"] = {"key": key, "value": None}
+    with timing.span("manifest"):
+        save_manifest(out_dir, manifest)
+    report_case(bundle, out_dir)
+    return bundle
+
+
+def run_pipeline_incremental(case_path: Path, out_dir: Path, mode: str = "baseline",
+                             policy_store: Optional[PolicyStore] = None, retriever: str = "auto",
+                             use_cache: bool = True, outputs: str = "full",
+                             use_server: bool = False) -> Dict[str, Any]:
+    """run_pipeline, re-running only the stages whose inputs or code changed since the last run into out_dir."""
+    with timing.collect() as timings:
+        with timing.span("total"):
+            case = load_case(case_path)
+            with timing.span("manifest"):
+                manifest = load_manifest(out_dir)
+            retrieved = memo_retrieve(manifest, case, policy_store, retriever)
+            extracted = memo_extract(manifest, case, retrieved, mode, use_cache, use_server)
+            bundle = memo_finish(manifest, case, retrieved, extracted, out_dir, outputs)
+
+    bundle["timings"] = timings
+    write_timings(out_dir, timings)
+    return bundle
@@ -0,0 +1,284 @@
+"""
+JSON encoding/decoding and the shapes of data crossing module boundaries.
+
+dumps/loads use the fastest installed backend: orjson, then msgspec, then
+the stdlib (PA_TRACE_JSON=orjson|msgspec|stdlib forces one). For what
+pa_trace writes (str keys, ints, short floats, unicode text) orjson and the
+stdlib produce the same bytes, pretty or compact; values orjson rejects
+(ints past 64 bits, lone surrogates) fall back to the stdlib.
+
+The dataclasses below describe cases, extracted facts and checklists.
+check_shape validates a plain dict against one at the boundary (case
+loading, extractor and cache results, stored bundles), so a bad value fails
+there with its path instead of deep inside build_checklist. The data itself
+stays a dict throughout the pipeline.
+"""
+import json
+import os
+import typing
+from dataclasses import MISSING, dataclass, field, fields, is_dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+
+JSON_BACKEND_ENV = "PA_TRACE_JSON"
+JSON_BACKENDS = ["orjson", "msgspec", "stdlib"]
+
+
+# -----------------------------------------------------------------------------
+# Backends
+# -----------------------------------------------------------------------------
+
+def _stdlib_dumps(obj: Any, pretty: bool) -> str:
+    if pretty:
+        return json.dumps(obj, indent=2, ensure_ascii=False)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def _select_backend() -> str:
+    wanted = os.environ.get(JSON_BACKEND_ENV)
+    if wanted and wanted not in JSON_BACKENDS:
+        print(f"[WARN] Unknown {JSON_BACKEND_ENV}={wanted!r}; expected one of {JSON_BACKENDS}")
+        wanted = None
+    for name in [wanted] if wanted else JSON_BACKENDS:
+        if name == "stdlib":
+            return name
+        try:
+            __import__(name)
+            return name
+        except ImportError:
+            if wanted:
+                print(f"[WARN] {JSON_BACKEND_ENV}={name} but {name} is not installed; using stdlib json")
+    return "stdlib"
+
+
+BACKEND = _select_backend()
+
+if BACKEND == "orjson":
+    import orjson
+
+    _ORJSON_OPTS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj: Any, pretty: bool = False) -> str:
+        """Serialize to a JSON string: 2-space indented if pretty, else compact."""
+        try:
+            return orjson.dumps(obj, option=_ORJSON_OPTS | (orjson.OPT_INDENT_2 if pretty else 0)).decode("utf-8")
+        except TypeError:
+            return _stdlib_dumps(obj, pretty)
+
+    def loads(data: Union[str, bytes]) -> Any:
+        return orjson.loads(data)
+
+elif BACKEND == "msgspec":
+    import msgspec
+
+    _encoder = msgspec.json.Encoder()
+    _decoder = msgspec.json.Decoder()
+
+    def dumps(obj: Any, pretty: bool = False) -> str:
+        """Serialize to a JSON string: 2-space indented if pretty, else compact."""
+        try:
+            raw = _encoder.encode(obj)
+        except (TypeError, OverflowError, msgspec.EncodeError):
+            return _stdlib_dumps(obj, pretty)
+        if pretty:
+            raw = msgspec.json.format(raw, indent=2)
+        return raw.decode("utf-8")
+
+    def loads(data: Union[str, bytes]) -> Any:
+        try:
+            return _decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from None
+
+else:
+    def dumps(obj: Any, pretty: bool = False) -> str:
+        """Serialize to a JSON string: 2-space indented if pretty, else compact."""
+        return _stdlib_dumps(obj, pretty)
+
+    def loads(data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+
+def read_json(path: Path) -> Any:
+    return loads(path.read_bytes())
+
+
+def write_json(path: Path, obj: Any, pretty: bool = False) -> None:
+    path.write_text(dumps(obj, pretty), encoding="utf-8")
+
+
+# -----------------------------------------------------------------------------
+# Shapes
+# -----------------------------------------------------------------------------
+# Fields with a default are optional; unknown keys are allowed everywhere.
+
+@dataclass
+class Case:
+    case_id: str
+    note_text: str = ""
+    patient: Dict[str, Any] = field(default_factory=dict)
+    requesting_provider: Dict[str, Any] = field(default_factory=dict)
+    exam_request: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class EvidenceSpan:
+    source: str
+    quote: str = ""
+    start: Optional[int] = None
+    end: Optional[int] = None
+    chunk_id: Optional[str] = None
+
+
+@dataclass
+class ExtractedFacts:
+    # Refusals carry only extraction_mode (plus a message), hence the defaults
+    extraction_mode: str
+    symptoms_duration_weeks: Optional[int] = None
+    conservative_care_weeks: Optional[int] = None
+    treatments: List[str] = field(default_factory=list)
+    red_flags: List[str] = field(default_factory=list)
+    red_flags_present: bool = False
+    evidence: Dict[str, List[EvidenceSpan]] = field(default_factory=dict)
+
+
+@dataclass
+class Checklist:
+    overall_status: str
+    criteria: List[Dict[str, Any]]
+    missing_evidence: List[str]
+
+
+@dataclass
+class ExtractRequest:
+    note_text: str
+    retrieved_policy: List[Dict[str, Any]] = field(default_factory=list)
+    mode: str = "llm"
+
+
+@dataclass
+class StoredBundle:
+    """bundle.json as written by the json/bundle output profiles."""
+    case: Case
+    retrieved_policy: List[Dict[str, Any]]
+    extracted: ExtractedFacts
+    checklist: Checklist
+
+
+def _type_name(tp: Any) -> str:
+    if typing.get_origin(tp) is Union:
+        return " or ".join("null" if a is type(None) else _type_name(a) for a in typing.get_args(tp))
+    origin = typing.get_origin(tp)
+    return getattr(origin or tp, "__name__", str(tp))
+
+
+_Checker = Callable[[Any], None]
+
+
+class _Mismatch(Exception):
+    """Raised by checkers; the path is collected while unwinding, so valid data builds no strings."""
+
+    def __init__(self, value: Any, expected: Any = None, message: Optional[str] = None):
+        self.path: List[str] = []
+        self.message = message or f"expected {_type_name(expected)}, got {type(value).__name__} {value!r:.60}"
+
+
+@lru_cache(maxsize=None)
+def _checker(tp: Any) -> _Checker:
+    """
+    Build a validator for a type annotation once; check_shape then runs only
+    isinstance tests (no typing introspection per value).
+    """
+    if tp is Any:
+        return lambda value: None
+    origin = typing.get_origin(tp)
+    if origin is Union:
+        args = typing.get_args(tp)
+        nullable = type(None) in args
+        inner = [_checker(a) for a in args if a is not type(None)]
+
+        def check_union(value: Any) -> None:
+            if value is None and nullable:
+                return
+            for check in inner:
+                try:
+                    check(value)
+                    return
+                except _Mismatch:
+                    pass
+            raise _Mismatch(value, tp)
+        return check_union
+    if is_dataclass(tp):
+        hints = typing.get_type_hints(tp)
+        required = [f.name for f in fields(tp) if f.default is MISSING and f.default_factory is MISSING]
+        field_checks = [(f.name, _checker(hints[f.name])) for f in fields(tp)]
+
+        def check_fields(value: Any) -> None:
+            if not isinstance(value, dict):
+                raise _Mismatch(value, tp)
+            for name in required:
+                if name not in value:
+                    raise _Mismatch(value, message=f"missing required key {name!r}")
+            for name, check in field_checks:
+                if name in value:
+                    try:
+                        check(value[name])
+                    except _Mismatch as e:
+                        e.path.append(f".{name}")
+                        raise
+        return check_fields
+    if origin is list:
+        (item_tp,) = typing.get_args(tp)
+        check_item = _checker(item_tp)
+
+        def check_list(value: Any) -> None:
+            if not isinstance(value, list):
+                raise _Mismatch(value, tp)
+            for i, item in enumerate(value):
+                try:
+                    check_item(item)
+                except _Mismatch as e:
+                    e.path.append(f"[{i}]")
+                    raise
+        return check_list
+    if origin is dict:
+        _, val_tp = typing.get_args(tp)
+        check_val = _checker(val_tp)
+
+        def check_dict(value: Any) -> None:
+            if not isinstance(value, dict):
+                raise _Mismatch(value, tp)
+            for k, v in value.items():
+                try:
+                    check_val(v)
+                except _Mismatch as e:
+                    e.path.append(f".{k}")
+                    raise
+        return check_dict
+    if tp is int:
+        def check_int(value: Any) -> None:
+            # bool is an int subclass, but never a valid count
+            if not isinstance(value, int) or isinstance(value, bool):
+                raise _Mismatch(value, tp)
+        return check_int
+
+    def check_type(value: Any) -> None:
+        if not isinstance(value, tp):
+            raise _Mismatch(value, tp)
+    return check_type
+
+
+def check_shape(obj: Any, shape: type, where: str) -> Any:
+    """
+    Validate a decoded JSON value against a shape dataclass and return it
+    unchanged. Raises ValueError naming the offending path, e.g.
+    "extracted.conservative_care_weeks: expected int or null, got str '8'".
+    """
+    try:
+        _checker(shape)(obj)
+    except _Mismatch as e:
+        if not e.path and not isinstance(obj, dict):
+            e.message = f"expected object, got {type(obj).__name__}"
+        raise ValueError(f"{where}{''.join(reversed(e.path))}: {e.message}") from None
+    return obj
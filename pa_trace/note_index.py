@@ -0,0 +1,113 @@
+"""
+Per-note substring index shared by LLM evidence validation and eval.
+
+Every quote check used to re-lowercase the note and scan it (or compile a
+word-boundary regex) from scratch. A NoteIndex lowercases the text once and
+memoizes each lookup. Once a note has answered GRAM_AFTER distinct queries
+it also builds a map from each GRAM-character substring to its positions,
+so a further lookup only verifies the positions that share the quote's
+first GRAM characters instead of scanning the note. Notes with a handful
+of quotes never pay for the map.
+
+note_index(text) returns the shared index for a text, so span validation,
+the baseline span boosts and eval's provenance check (notes and policy
+chunks) reuse the same one; the offsets it finds are the ones written into
+the evidence spans that highlights.html marks.
+Case-insensitive means "equal after str.lower()", as in the code this
+replaces; offsets are positions in the lowered text, which are the
+original text's positions unless lowering changed the length.
+"""
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+# Length of the substrings keyed in the position map
+GRAM = 4
+# Distinct lookups on one note before the position map is built. Building it
+# costs about as much as a few hundred scans of the lowered text, whatever
+# the note's length, so it only pays off for notes queried that often.
+GRAM_AFTER = 256
+
+_WORD_CHAR = re.compile(r"\w")
+
+
+def _is_word(text: str, i: int) -> bool:
+    return 0 <= i < len(text) and _WORD_CHAR.match(text, i) is not None
+
+
+class NoteIndex:
+    """Lowercased text, lookup memo and (lazily) k-gram positions for one note."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.lower = text.lower()
+        # Offsets line up with the original text unless lowering changed the length
+        self.aligned = len(self.lower) == len(text)
+        self._memo: Dict[Tuple[str, bool, bool], int] = {}
+        self._grams: Dict[bool, Dict[str, List[int]]] = {}
+
+    def _positions(self, quote: str, ignore_case: bool) -> Optional[List[int]]:
+        grams = self._grams.get(ignore_case)
+        if grams is None:
+            if len(self._memo) < GRAM_AFTER:
+                return None
+            hay = self.lower if ignore_case else self.text
+            grams = {}
+            for i in range(len(hay) - GRAM + 1):
+                grams.setdefault(hay[i:i + GRAM], []).append(i)
+            self._grams[ignore_case] = grams
+        return grams.get(quote[:GRAM], [])
+
+    def _occurrences(self, quote: str, ignore_case: bool):
+        """Start offsets of quote, in increasing order."""
+        hay = self.lower if ignore_case else self.text
+        if ignore_case:
+            quote = quote.lower()
+        positions = self._positions(quote, ignore_case) if len(quote) >= GRAM else None
+        if positions is not None:
+            for i in positions:
+                if hay.startswith(quote, i):
+                    yield i
+            return
+        i = hay.find(quote)
+        while i != -1:
+            yield i
+            i = hay.find(quote, i + 1)
+
+    def _lookup(self, quote: str, ignore_case: bool, word: bool) -> int:
+        key = (quote, ignore_case, word)
+        idx = self._memo.get(key)
+        if idx is None:
+            idx = -1
+            for i in self._occurrences(quote, ignore_case):
+                if not word or self._word_bounded(quote, i):
+                    idx = i
+                    break
+            self._memo[key] = idx
+        return idx
+
+    def _word_bounded(self, quote: str, i: int) -> bool:
+        # Same test as \b on both ends: word-ness differs across each edge
+        t, end = self.text, i + len(quote)
+        return _is_word(t, i - 1) != _is_word(t, i) and _is_word(t, end - 1) != _is_word(t, end)
+
+    def find(self, quote: str, ignore_case: bool = True) -> int:
+        """First offset of quote in the note, or -1."""
+        return self._lookup(quote, ignore_case, False)
+
+    def find_word(self, quote: str) -> int:
+        """First case-insensitive match of quote with a word boundary (\\b) at both ends, or -1."""
+        if not self.aligned:
+            m = re.search(r"\b" + re.escape(quote) + r"\b", self.text, re.IGNORECASE)
+            return m.start() if m else -1
+        return self._lookup(quote, True, True)
+
+    def __contains__(self, quote: str) -> bool:
+        """Exact (case-sensitive) substring test, like `quote in text`."""
+        return self.find(quote, ignore_case=False) != -1
+
+
+@lru_cache(maxsize=256)
+def note_index(text: str) -> NoteIndex:
+    """The shared NoteIndex for a text (recent texts are kept)."""
+    return NoteIndex(text)
@@ -1,37 +1,60 @@
-import json
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 
-from .policy_store import load_policy_store
-from .retrieval import retrieve_policy_chunks
+from .cache import extraction_key, get_extraction_cache
+from .policy_store import PolicyStore, get_policy_store
+from .server import extract_remote
+from .retrieval import retrieve
 from .extraction_baseline import extract_facts_baseline
 from .extraction_llm import extract_facts_llm
 from .checklist import build_checklist
-from .assemble import write_packet_bundle
+from .jsonio import Case, ExtractedFacts, check_shape, read_json, write_json
+from .assemble import build_packet, write_packet_bundle
+from . import timing
 
 DEFAULT_POLICY_PATH = Path(__file__).resolve().parent.parent / "policies" / "policy_demo_spine_mri.json"
 
-def run_pipeline(case_path: Path, out_dir: Path, mode: str = "baseline") -> Dict[str, Any]:
-    out_dir.mkdir(parents=True, exist_ok=True)
-    case = json.loads(case_path.read_text(encoding="utf-8"))
+def _default_store(policy_store: Optional[PolicyStore]) -> PolicyStore:
+    # Load policy store (chunked text); parsed and indexed once per process
+    if policy_store is None:
+        policy_store = get_policy_store(DEFAULT_POLICY_PATH)
+    return policy_store
 
-    # Load policy store (chunked text)
-    policy_store = load_policy_store(DEFAULT_POLICY_PATH)
 
+def retrieval_query(case: Dict[str, Any]) -> str:
     # Retrieve relevant policy chunks for the requested exam
-    query = f"{case.get('exam_request', {}).get('procedure', '')} criteria conservative care red flags"
-    retrieved = retrieve_policy_chunks(policy_store, query=query, k=3)
+    return f"{case.get('exam_request', {}).get('procedure', '')} criteria conservative care red flags"
+
+
+def retrieve_for_case(case: Dict[str, Any], policy_store: Optional[PolicyStore] = None,
+                      retriever: str = "auto") -> List[Dict[str, Any]]:
+    with timing.span("policy_load"):
+        policy_store = _default_store(policy_store)
+
+    with timing.span("retrieval"):
+        return retrieve(policy_store, query=retrieval_query(case), k=3, method=retriever)
 
-    # Extract structured facts from note text
-    note_text = case.get("note_text", "")
 
-    if mode == "baseline":
-        extracted = extract_facts_baseline(note_text=note_text, retrieved_policy=retrieved)
-    else:
-        extracted = extract_facts_llm(note_text=note_text, retrieved_policy=retrieved)
+def load_case(case_path: Path) -> Dict[str, Any]:
+    with timing.span("load_case"):
+        return check_shape(read_json(case_path), Case, str(case_path))
+
+
+def prepare_case(case_path: Path, policy_store: Optional[PolicyStore] = None,
+                 retriever: str = "auto") -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Read a case and retrieve its policy chunks (everything before extraction)."""
+    case = load_case(case_path)
+    return case, retrieve_for_case(case, policy_store, retriever)
+
+
+def finish_case(case: Dict[str, Any], retrieved: List[Dict[str, Any]], extracted: Dict[str, Any],
+                out_dir: Path, outputs: str = "full") -> Dict[str, Any]:
+    """Checklist + packet bundle for an extracted case (everything after extraction)."""
+    out_dir.mkdir(parents=True, exist_ok=True)
 
     # Build checklist (deterministic)
-    checklist = build_checklist(extracted)
+    with timing.span("checklist"):
+        checklist = build_checklist(extracted)
 
     # Assemble outputs
     bundle = {
@@ -40,11 +63,89 @@ def run_pipeline(case_path: Path, out_dir: Path, mode: str = "baseline") -> Dict
         "extracted": extracted,
         "checklist": checklist,
     }
-    write_packet_bundle(bundle=bundle, out_dir=out_dir)
+    write_packet_bundle(bundle=bundle, out_dir=out_dir, outputs=outputs)
+    report_case(bundle, out_dir)
+    return bundle
+
 
+def report_case(bundle: Dict[str, Any], out_dir: Path) -> None:
     # Console summary for demo recording
-    print(f"[PA-Trace] Case: {case.get('case_id')}")
-    print(f"[PA-Trace] Retrieved policy chunks: {[c['chunk_id'] for c in retrieved]}")
+    checklist = bundle["checklist"]
+    print(f"[PA-Trace] Case: {bundle['case'].get('case_id')}")
+    print(f"[PA-Trace] Retrieved policy chunks: {[c['chunk_id'] for c in bundle['retrieved_policy']]}")
     print(f"[PA-Trace] Decision: {checklist['overall_status']} | Missing: {checklist['missing_evidence']}")
     print(f"[PA-Trace] Wrote bundle to: {out_dir.resolve()}")
+
+
+def case_record(case: Dict[str, Any], extracted: Dict[str, Any]) -> Dict[str, Any]:
+    """Compact per-case result (packet, checklist, provenance) for JSONL output."""
+    checklist = build_checklist(extracted)
+    return {
+        "case_id": case.get("case_id"),
+        "packet": build_packet(case, extracted, checklist),
+        "checklist": checklist,
+        "provenance": extracted.get("evidence", {}),
+    }
+
+
+def cacheable_result(extracted: Dict[str, Any]) -> Dict[str, Any]:
+    # Per-run token stats describe the original call, not a cache hit
+    return {k: v for k, v in extracted.items() if k != "llm_stats"}
+
+
+def extract_facts(note_text: str, retrieved: List[Dict[str, Any]], mode: str = "baseline",
+                  use_cache: bool = True, use_server: bool = False) -> Dict[str, Any]:
+    """
+    Extract structured facts from note text, consulting the on-disk result
+    cache (model modes only). use_server: in llm mode, try a running
+    `pa-trace serve` first (single-case runs only; see server.py).
+    """
+    # Baseline extraction takes microseconds: cheaper than a cache read + write
+    use_cache = use_cache and mode != "baseline"
+    if use_cache:
+        with timing.span("cache_lookup"):
+            cache = get_extraction_cache()
+            key = extraction_key(mode, note_text, retrieved)
+            hit = cache.get(key)
+        if hit is not None:
+            return check_shape(hit, ExtractedFacts, "cached extraction")
+
+    with timing.span("extract"):
+        if mode == "baseline":
+            extracted = extract_facts_baseline(note_text=note_text, retrieved_policy=retrieved)
+        else:
+            # Prefer a resident model (`pa-trace serve`) over loading one here
+            extracted = extract_remote(note_text, retrieved, mode=mode) if use_server else None
+            if extracted is None:
+                extracted = extract_facts_llm(note_text=note_text, retrieved_policy=retrieved)
+            else:
+                check_shape(extracted, ExtractedFacts, "server extraction")
+
+    if use_cache:
+        with timing.span("cache_store"):
+            cache.put(key, cacheable_result(extracted))
+    return extracted
+
+
+def write_timings(out_dir: Path, timings: Dict[str, float]) -> None:
+    """Per-case stage timings (milliseconds) next to the bundle."""
+    spans = {name: round(sec * 1000, 3) for name, sec in timings.items()}
+    write_json(out_dir / "timings.json", {"unit": "ms", "spans": spans}, pretty=True)
+
+
+def run_pipeline(case_path: Path, out_dir: Path, mode: str = "baseline", policy_store: Optional[PolicyStore] = None,
+                 retriever: str = "auto", use_cache: bool = True, outputs: str = "full",
+                 use_server: bool = False) -> Dict[str, Any]:
+    with timing.collect() as timings:
+        with timing.span("total"):
+            case, retrieved = prepare_case(case_path, policy_store, retriever)
+
+            # Extract structured facts from note text
+            extracted = extract_facts(case.get("note_text", ""), retrieved, mode=mode, use_cache=use_cache,
+                                      use_server=use_server)
+
+            bundle = finish_case(case, retrieved, extracted, out_dir, outputs)
+
+    bundle["timings"] = timings
+    write_timings(out_dir, timings)
     return bundle
@@ -0,0 +1,105 @@
+"""
+Asyncio front end to the pipeline, for services embedding pa_trace.
+
+Each stage of run_pipeline runs on the event loop's default thread pool
+(file reads, retrieval, extraction, checklist + bundle writes), so hundreds
+of cases can be in flight as cheap coroutines sharing a handful of threads:
+one case's baseline extraction overlaps another's output writes. The model
+context itself is guarded by a lock in extraction_llm, which also covers
+several event loops and cancelled callers. On top of that a per-loop
+semaphore (MODEL_CONCURRENCY) caps how many LLM extractions wait for it, so
+a backlog doesn't park every pool thread on the lock.
+"""
+import asyncio
+import weakref
+from collections import deque
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional
+
+from . import timing
+from .pipeline import extract_facts, finish_case, prepare_case, write_timings
+from .policy_store import PolicyStore
+
+# LLM extractions per event loop handed to threads at once (back-pressure only;
+# the model's lock serialises the generations themselves)
+MODEL_CONCURRENCY = 1
+DEFAULT_CONCURRENCY = 64
+
+_model_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _model_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    sem = _model_slots.get(loop)
+    if sem is None:
+        sem = _model_slots[loop] = asyncio.Semaphore(MODEL_CONCURRENCY)
+    return sem
+
+
+async def _extract_async(note_text: str, retrieved: List[Dict[str, Any]], mode: str,
+                         use_cache: bool) -> Dict[str, Any]:
+    if mode == "baseline":
+        return await asyncio.to_thread(extract_facts, note_text, retrieved, mode, use_cache)
+    async with _model_semaphore():
+        task = asyncio.ensure_future(asyncio.to_thread(extract_facts, note_text, retrieved, mode, use_cache))
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # The thread runs on regardless: keep the slot until it is done
+            await asyncio.wait({task})
+            raise
+
+
+async def run_pipeline_async(case_path: Path, out_dir: Path, mode: str = "baseline",
+                             policy_store: Optional[PolicyStore] = None, retriever: str = "auto",
+                             use_cache: bool = True, outputs: str = "full") -> Dict[str, Any]:
+    """Async run_pipeline: same outputs, without blocking the event loop."""
+    return await _run_case_async(case_path, lambda case: out_dir, mode, policy_store, retriever, use_cache, outputs)
+
+
+async def _run_case_async(case_path: Path, out_dir_for: Callable[[Dict[str, Any]], Path], mode: str,
+                          policy_store: Optional[PolicyStore], retriever: str, use_cache: bool,
+                          outputs: str = "full") -> Dict[str, Any]:
+    # Spans recorded in worker threads land here: to_thread copies the context
+    with timing.collect() as timings:
+        with timing.span("total"):
+            case, retrieved = await asyncio.to_thread(prepare_case, case_path, policy_store, retriever)
+            extracted = await _extract_async(case.get("note_text", ""), retrieved, mode, use_cache)
+            out_dir = out_dir_for(case)
+            bundle = await asyncio.to_thread(finish_case, case, retrieved, extracted, out_dir, outputs)
+    bundle["timings"] = timings
+    await asyncio.to_thread(write_timings, out_dir, timings)
+    return bundle
+
+
+async def iter_many_async(case_paths: Iterable[Path], out_root: Path, mode: str = "baseline",
+                          concurrency: int = DEFAULT_CONCURRENCY, policy_store: Optional[PolicyStore] = None,
+                          retriever: str = "auto", use_cache: bool = True,
+                          outputs: str = "full") -> AsyncIterator[Dict[str, Any]]:
+    """
+    Run many cases with at most `concurrency` in flight, yielding bundles in
+    input order. case_paths is consumed lazily, so it may be a generator.
+    """
+    pending: deque = deque()
+    try:
+        for cp in case_paths:
+            # Like batch._run_case: the output folder is named after the case_id inside the file
+            pending.append(asyncio.ensure_future(_run_case_async(
+                cp, lambda case: out_root / case["case_id"], mode, policy_store, retriever, use_cache, outputs)))
+            if len(pending) >= concurrency:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def run_many_async(case_paths: Iterable[Path], out_root: Path, mode: str = "baseline",
+                         concurrency: int = DEFAULT_CONCURRENCY, policy_store: Optional[PolicyStore] = None,
+                         retriever: str = "auto", use_cache: bool = True,
+                         outputs: str = "full") -> List[Dict[str, Any]]:
+    """Collect iter_many_async into a list (input order)."""
+    return [b async for b in iter_many_async(case_paths, out_root, mode=mode, concurrency=concurrency,
+                                             policy_store=policy_store, retriever=retriever,
+                                             use_cache=use_cache, outputs=outputs)]
@@ -0,0 +1,262 @@
+"""
+Compiled on-disk policy index, loaded with mmap.
+
+`build_policy_index` compiles one or more policy JSON files into a single
+binary file holding the chunks, the vocabulary and both posting tables
+(token overlap + BM25F). `open_policy_index` maps it read-only, so a cold
+start does no JSON parsing beyond the chunks actually retrieved, and
+worker processes opening the same file share its pages.
+
+Layout (native byte order, sections 8-byte aligned):
+  header   MAGIC, byte order, n_chunks, n_terms, (offset, length) per section
+  chunk_offsets   u64[n_chunks + 1]  into chunk_blob
+  chunk_blob      compact JSON per chunk, utf-8
+  term_offsets    u64[n_terms + 1]   into term_blob (terms sorted)
+  term_blob       utf-8
+  bm25_offsets    u64[n_terms + 1]   into bm25_ids / bm25_weights
+  bm25_ids        u32[]
+  bm25_weights    f64[]
+  overlap_offsets u64[n_terms + 1]   into overlap_ids
+  overlap_ids     u32[]
+  meta            JSON (source files)
+"""
+import bisect
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .policy_store import PolicyStore, load_policy_store
+from .retrieval import BM25Index
+
+MAGIC = b"PATIDX01"
+SECTIONS = [
+    "chunk_offsets", "chunk_blob", "term_offsets", "term_blob",
+    "bm25_offsets", "bm25_ids", "bm25_weights",
+    "overlap_offsets", "overlap_ids", "meta",
+]
+_HEADER = struct.Struct("<8sBxxxII" + "QQ" * len(SECTIONS))
+_BYTEORDER = {"little": 0, "big": 1}
+
+
+def is_policy_index(path: Path) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+# -----------------------------------------------------------------------------
+# Build
+# -----------------------------------------------------------------------------
+def build_policy_index(policy_paths: Sequence[Path], out_path: Path) -> Dict[str, Any]:
+    """
+    Compile policy JSON files into one index file at out_path.
+    Chunk ids must be unique across all inputs.
+    """
+    chunks: List[Dict[str, Any]] = []
+    seen = set()
+    for p in policy_paths:
+        for ch in load_policy_store(p):
+            if ch["chunk_id"] in seen:
+                raise ValueError(f"Duplicate chunk_id {ch['chunk_id']!r} in {p}")
+            seen.add(ch["chunk_id"])
+            chunks.append(ch)
+
+    store = PolicyStore(chunks)
+    bm25 = store.bm25
+    terms = sorted(set(store.postings) | set(bm25.postings))
+
+    chunk_offsets = array("Q", [0])
+    chunk_blob = bytearray()
+    for ch in chunks:
+        chunk_blob += json.dumps(ch, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        chunk_offsets.append(len(chunk_blob))
+
+    term_offsets = array("Q", [0])
+    term_blob = bytearray()
+    bm25_offsets = array("Q", [0])
+    bm25_ids = array("I")
+    bm25_weights = array("d")
+    overlap_offsets = array("Q", [0])
+    overlap_ids = array("I")
+    for t in terms:
+        term_blob += t.encode("utf-8")
+        term_offsets.append(len(term_blob))
+        ids, weights = bm25.postings.get(t, ([], []))
+        bm25_ids.extend(ids)
+        bm25_weights.extend(weights)
+        bm25_offsets.append(len(bm25_ids))
+        overlap_ids.extend(store.postings.get(t, []))
+        overlap_offsets.append(len(overlap_ids))
+
+    meta = json.dumps({"sources": [str(p) for p in policy_paths]}).encode("utf-8")
+    payloads = {
+        "chunk_offsets": chunk_offsets.tobytes(), "chunk_blob": bytes(chunk_blob),
+        "term_offsets": term_offsets.tobytes(), "term_blob": bytes(term_blob),
+        "bm25_offsets": bm25_offsets.tobytes(), "bm25_ids": bm25_ids.tobytes(),
+        "bm25_weights": bm25_weights.tobytes(),
+        "overlap_offsets": overlap_offsets.tobytes(), "overlap_ids": overlap_ids.tobytes(),
+        "meta": meta,
+    }
+
+    table: List[int] = []
+    body = bytearray()
+    pos = _HEADER.size
+    for name in SECTIONS:
+        pad = -pos % 8
+        body += b"\0" * pad
+        pos += pad
+        data = payloads[name]
+        table += [pos, len(data)]
+        body += data
+        pos += len(data)
+    header = _HEADER.pack(MAGIC, _BYTEORDER[sys.byteorder], len(chunks), len(terms), *table)
+
+    # Write to a temp file and rename, so processes that already mapped the
+    # old index keep reading a consistent file.
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_path.with_name(out_path.name + ".tmp")
+    tmp.write_bytes(header + bytes(body))
+    os.replace(tmp, out_path)
+
+    return {"path": str(out_path), "n_chunks": len(chunks), "n_terms": len(terms), "bytes": pos}
+
+
+# -----------------------------------------------------------------------------
+# Load
+# -----------------------------------------------------------------------------
+class _Terms:
+    """Sorted vocabulary read straight from the map (sequence for bisect)."""
+
+    def __init__(self, offsets: memoryview, blob: memoryview):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return bytes(self._blob[self._offsets[i]:self._offsets[i + 1]]).decode("utf-8")
+
+    def find(self, term: str) -> int:
+        i = bisect.bisect_left(self, term)
+        return i if i < len(self) and self[i] == term else -1
+
+
+class _MappedOverlapPostings:
+    """token -> chunk indexes (same interface PolicyStore.postings exposes)."""
+
+    def __init__(self, terms: _Terms, offsets: memoryview, ids: memoryview):
+        self._terms = terms
+        self._offsets = offsets
+        self._ids = ids
+
+    def get(self, term: str, default=None):
+        i = self._terms.find(term)
+        if i < 0:
+            return default
+        return self._ids[self._offsets[i]:self._offsets[i + 1]]
+
+
+class _MappedBM25Postings:
+    """token -> (chunk indexes, weights), as in BM25Index.postings."""
+
+    def __init__(self, terms: _Terms, offsets: memoryview, ids: memoryview, weights: memoryview):
+        self._terms = terms
+        self._offsets = offsets
+        self._ids = ids
+        self._weights = weights
+
+    def get(self, term: str, default=None) -> Optional[Tuple[memoryview, memoryview]]:
+        i = self._terms.find(term)
+        if i < 0:
+            return default
+        lo, hi = self._offsets[i], self._offsets[i + 1]
+        if lo == hi:
+            return default
+        return self._ids[lo:hi], self._weights[lo:hi]
+
+    def __contains__(self, term: str) -> bool:
+        return self.get(term) is not None
+
+    def __getitem__(self, term: str) -> Tuple[memoryview, memoryview]:
+        entry = self.get(term)
+        if entry is None:
+            raise KeyError(term)
+        return entry
+
+
+class MappedBM25Index(BM25Index):
+    """BM25Index whose postings live in the mapped file."""
+
+    def __init__(self, n_docs: int, postings: _MappedBM25Postings):
+        self.n_docs = n_docs
+        self.postings = postings
+
+
+class MappedPolicyStore(PolicyStore):
+    """
+    PolicyStore backed by a mapped index file. Chunks are decoded from the
+    map on first access; retrieval reads postings directly from the map.
+    """
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.path = path
+        self.mtime_ns = path.stat().st_mtime_ns
+
+        fields = _HEADER.unpack_from(self._mm, 0)
+        magic, byteorder, n_chunks, n_terms = fields[:4]
+        if magic != MAGIC:
+            raise ValueError(f"Not a policy index: {path}")
+        if byteorder != _BYTEORDER[sys.byteorder]:
+            raise ValueError(f"Policy index {path} was built on a machine with a different byte order; rebuild it")
+        mv = memoryview(self._mm)
+        sec = {}
+        for name, off, length in zip(SECTIONS, fields[4::2], fields[5::2]):
+            sec[name] = mv[off:off + length]
+
+        self._n_chunks = n_chunks
+        self._chunk_offsets = sec["chunk_offsets"].cast("Q")
+        self._chunk_blob = sec["chunk_blob"]
+        self._decoded: Dict[int, Dict[str, Any]] = {}
+        terms = _Terms(sec["term_offsets"].cast("Q"), sec["term_blob"])
+        self.postings = _MappedOverlapPostings(terms, sec["overlap_offsets"].cast("Q"), sec["overlap_ids"].cast("I"))
+        self._bm25 = MappedBM25Index(n_chunks, _MappedBM25Postings(
+            terms, sec["bm25_offsets"].cast("Q"), sec["bm25_ids"].cast("I"), sec["bm25_weights"].cast("d"),
+        ))
+        self.meta = json.loads(bytes(sec["meta"]).decode("utf-8"))
+
+    def __reduce__(self):
+        # Worker processes re-open (and re-map) the file instead of pickling the map
+        return (MappedPolicyStore, (self.path,))
+
+    def __len__(self) -> int:
+        return self._n_chunks
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        if i < 0:
+            i += self._n_chunks
+        if not 0 <= i < self._n_chunks:
+            raise IndexError(i)
+        ch = self._decoded.get(i)
+        if ch is None:
+            raw = self._chunk_blob[self._chunk_offsets[i]:self._chunk_offsets[i + 1]]
+            ch = json.loads(bytes(raw).decode("utf-8"))
+            self._decoded[i] = ch
+        return ch
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return (self[i] for i in range(self._n_chunks))
+
+    @property
+    def chunks(self) -> List[Dict[str, Any]]:
+        return list(self)
+
+
+def open_policy_index(path: Path) -> MappedPolicyStore:
+    return MappedPolicyStore(path)
@@ -1,10 +1,81 @@
 import json
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional
 
-def load_policy_store(path: Path) -> List[Dict[str, Any]]:
+from .retrieval import BM25Index, _tokenize
+
+
+class PolicyStore:
+    """
+    Parsed policy chunks plus the retrieval index, built once per load.
+
+    Behaves like the plain list of chunk dicts it wraps (len/iter/index), so
+    code written against the old list-returning loader keeps working.
+    `postings` maps each token to the sorted indexes of chunks containing it.
+    """
+
+    def __init__(self, chunks: List[Dict[str, Any]], path: Optional[Path] = None, mtime_ns: Optional[int] = None):
+        self.chunks = chunks
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.postings: Dict[str, List[int]] = {}
+        for i, ch in enumerate(chunks):
+            for tok in set(_tokenize(ch["text"])):
+                self.postings.setdefault(tok, []).append(i)
+        self._bm25: Optional[BM25Index] = None
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self.chunks)
+
+    def __getitem__(self, i):
+        return self.chunks[i]
+
+    @property
+    def bm25(self) -> BM25Index:
+        """BM25F index over title + text, built on first use."""
+        if self._bm25 is None:
+            self._bm25 = BM25Index(self.chunks)
+        return self._bm25
+
+    def is_stale(self) -> bool:
+        """True if the backing file changed (or vanished) since it was loaded."""
+        if self.path is None:
+            return False
+        try:
+            return self.path.stat().st_mtime_ns != self.mtime_ns
+        except OSError:
+            return True
+
+
+def load_policy_store(path: Path) -> PolicyStore:
+    """
+    Load a policy JSON file, or memory-map a compiled index (`pa-trace index build`).
+    """
+    from .policy_index import is_policy_index, open_policy_index
+    if is_policy_index(path):
+        return open_policy_index(path)
+
+    mtime_ns = path.stat().st_mtime_ns
     data = json.loads(path.read_text(encoding="utf-8"))
     assert isinstance(data, list), "Policy store must be a list of chunks"
     for c in data:
         assert "chunk_id" in c and "text" in c
-    return data
+    return PolicyStore(data, path=path, mtime_ns=mtime_ns)
+
+
+_STORES: Dict[Path, PolicyStore] = {}
+
+
+def get_policy_store(path: Path) -> PolicyStore:
+    """
+    Process-wide cached PolicyStore for `path`; reloaded when the file's mtime changes.
+    """
+    key = path.resolve()
+    store = _STORES.get(key)
+    if store is None or store.is_stale():
+        store = load_policy_store(key)
+        _STORES[key] = store
+    return store
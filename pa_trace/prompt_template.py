@@ -1,4 +1,9 @@
-PROMPT_TEMPLATE = r"""
+import json
+
+# Fixed instructions, schema and allowed values. Nothing case-specific goes
+# here: it forms a stable prompt prefix whose llama.cpp state is computed once
+# and reused for every case (see extraction_llm._restore_prefix).
+PROMPT_INSTRUCTIONS = r"""
 You are extracting structured fields for a prior-authorization (PA) packet draft.
 You MUST follow these rules:
 
@@ -62,29 +67,91 @@ COMMON ERRORS TO AVOID:
   WRONG: "29-year-old" -> symptoms_duration_weeks: 29
   RIGHT: If no duration stated, output null and list in missing_evidence.
 
-Input NOTE (string):
-{note_text}
-
-Retrieved POLICY CHUNKS (array of objects with chunk_id,text):
-{policy_chunks_json}
-
 Return JSON with this schema:
-{{
+{
   "symptoms_duration_weeks": <int|null>,
   "conservative_care_weeks": <int|null>,
   "treatments": <array of strings>,
   "red_flags": <array of strings>,
   "red_flags_present": <bool>,
-  "evidence": {{
-     "symptoms_duration_weeks": [{{"source":"note","start":<int>,"end":<int>,"quote":"..."}}] | [],
-     "conservative_care_weeks": [{{...}}] | [],
-     "treatments": [{{...}}] | [],
-     "red_flags": [{{...}}] | []
-  }},
+  "evidence": {
+     "symptoms_duration_weeks": [{"source":"note","start":<int>,"end":<int>,"quote":"..."}] | [],
+     "conservative_care_weeks": [{...}] | [],
+     "treatments": [{...}] | [],
+     "red_flags": [{...}] | []
+  },
   "missing_evidence": <array of strings>,
   "extraction_mode": "llm"
-}}
+}
+
+"""
+
+# Allowed values (enums in EXTRACTION_SCHEMA, listed in the prompt too)
+RED_FLAG_VALUES = ["cauda_equina", "progressive_neuro_deficit", "cancer", "infection", "fracture_trauma"]
+TREATMENT_VALUES = ["pt", "nsaids", "home_exercise", "chiropractic", "steroid", "injection"]
+EVIDENCE_FIELDS = ["symptoms_duration_weeks", "conservative_care_weeks", "treatments", "red_flags"]
 
-Allowed red_flags values: ["cauda_equina","progressive_neuro_deficit","cancer","infection","fracture_trauma"]
-Allowed treatments values: ["pt","nsaids","home_exercise","chiropractic","steroid","injection"]
+# Evidence budget per field: caps decode length (and duplicate/padding spans)
+EVIDENCE_MAX_SPANS = 3
+EVIDENCE_MAX_QUOTE_CHARS = 160
+
+PROMPT_INSTRUCTIONS += (
+    f"Allowed red_flags values: {json.dumps(RED_FLAG_VALUES, separators=(',', ':'))}\n"
+    f"Allowed treatments values: {json.dumps(TREATMENT_VALUES, separators=(',', ':'))}\n"
+)
+
+# Case-specific inputs, appended after the instructions. Policy chunks come
+# first: cases for the same procedure retrieve the same chunks, so the cached
+# prefix often extends through them as well.
+PROMPT_INPUTS = r"""
+Retrieved POLICY CHUNKS (array of objects with chunk_id,text):
+{policy_chunks_json}
+
+Input NOTE (string):
+{note_text}
 """
+
+# JSON schema of the model output (the schema block above, made exact).
+# extraction_llm compiles it to a llama.cpp grammar, so sampling can only
+# produce a parseable object with these keys, in this order, and no prose.
+_EVIDENCE_SPAN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "source": {"enum": ["note"]},
+        "start": {"type": "integer"},
+        "end": {"type": "integer"},
+        "quote": {"type": "string", "maxLength": EVIDENCE_MAX_QUOTE_CHARS},
+    },
+    "required": ["source", "start", "end", "quote"],
+    "additionalProperties": False,
+}
+
+EXTRACTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "symptoms_duration_weeks": {"type": ["integer", "null"]},
+        "conservative_care_weeks": {"type": ["integer", "null"]},
+        "treatments": {"type": "array", "items": {"enum": TREATMENT_VALUES}},
+        "red_flags": {"type": "array", "items": {"enum": RED_FLAG_VALUES}},
+        "red_flags_present": {"type": "boolean"},
+        "evidence": {
+            "type": "object",
+            "properties": {
+                f: {"type": "array", "items": _EVIDENCE_SPAN_SCHEMA, "maxItems": EVIDENCE_MAX_SPANS}
+                for f in EVIDENCE_FIELDS
+            },
+            "required": EVIDENCE_FIELDS,
+            "additionalProperties": False,
+        },
+        "missing_evidence": {"type": "array", "items": {"enum": EVIDENCE_FIELDS}},
+        "extraction_mode": {"const": "llm"},
+    },
+    "required": [
+        "symptoms_duration_weeks", "conservative_care_weeks", "treatments", "red_flags",
+        "red_flags_present", "evidence", "missing_evidence", "extraction_mode",
+    ],
+    "additionalProperties": False,
+}
+
+# Full template (str.format with note_text, policy_chunks_json)
+PROMPT_TEMPLATE = PROMPT_INSTRUCTIONS.replace("{", "{{").replace("}", "}}") + PROMPT_INPUTS
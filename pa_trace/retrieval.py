@@ -1,19 +1,131 @@
+import heapq
+import math
 import re
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Iterable, Tuple
+
+# BM25F parameters (title + text fields)
+BM25_K1 = 1.2
+BM25_B = 0.75
+BM25_FIELD_WEIGHTS = {"title": 2.0, "text": 1.0}
+
+# Below this many chunks the linear overlap scan is as fast as anything else
+BM25_MIN_CHUNKS = 256
+
+RETRIEVERS = ["auto", "overlap", "bm25"]
 
 def _tokenize(s: str) -> List[str]:
     return re.findall(r"[a-z0-9]+", s.lower())
 
-def retrieve_policy_chunks(policy_store: List[Dict[str, Any]], query: str, k: int = 3) -> List[Dict[str, Any]]:
+def retrieve_policy_chunks(policy_store, query: str, k: int = 3) -> List[Dict[str, Any]]:
     """
     Lightweight retrieval: score chunks by token overlap (good enough for MVP).
-    Swap for BM25/embeddings later if desired.
+    Kept as the small-store fallback; see retrieve_policy_chunks_bm25 for large stores.
+
+    Accepts a plain list of chunks or a PolicyStore; with a PolicyStore the
+    prebuilt postings are used instead of re-tokenizing every chunk.
     """
     q = set(_tokenize(query))
-    scored: List[Tuple[float, Dict[str, Any]]] = []
-    for ch in policy_store:
-        t = set(_tokenize(ch["text"]))
-        score = len(q & t) / max(1, len(q))
-        scored.append((score, ch))
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return [c for _, c in scored[:k]]
+    postings = getattr(policy_store, "postings", None)
+    if postings is None:
+        scored: List[Tuple[float, Dict[str, Any]]] = []
+        for ch in policy_store:
+            t = set(_tokenize(ch["text"]))
+            score = len(q & t) / max(1, len(q))
+            scored.append((score, ch))
+        scored.sort(key=lambda x: x[0], reverse=True)
+        return [c for _, c in scored[:k]]
+
+    # Count query-token hits per chunk from the postings; chunks with no hits
+    # score 0 and fill remaining slots in store order (same as a stable sort).
+    hits: Dict[int, int] = {}
+    for tok in q:
+        for i in postings.get(tok, ()):
+            hits[i] = hits.get(i, 0) + 1
+    ranked = sorted(hits, key=lambda i: (-hits[i], i))[:k]
+    if len(ranked) < k:
+        seen = set(ranked)
+        ranked += [i for i in range(len(policy_store)) if i not in seen][:k - len(ranked)]
+    return [policy_store[i] for i in ranked]
+
+
+class BM25Index:
+    """
+    BM25F over chunk `title` + `text`, backed by an inverted index.
+
+    Field-normalized term frequencies are query-independent, so each posting
+    stores the saturated weight tf~/(k1 + tf~) up front and a query only sums
+    idf * weight over the postings of its terms.
+    """
+
+    def __init__(self, chunks: Iterable[Dict[str, Any]]):
+        field_tokens = []
+        for ch in chunks:
+            field_tokens.append({f: _tokenize(ch.get(f) or "") for f in BM25_FIELD_WEIGHTS})
+        self.n_docs = len(field_tokens)
+        avg_len = {
+            f: (sum(len(d[f]) for d in field_tokens) / self.n_docs) if self.n_docs else 0.0
+            for f in BM25_FIELD_WEIGHTS
+        }
+
+        postings: Dict[str, Tuple[List[int], List[float]]] = {}
+        for i, fields in enumerate(field_tokens):
+            tf: Dict[str, float] = {}
+            for f, toks in fields.items():
+                if not toks:
+                    continue
+                norm = BM25_FIELD_WEIGHTS[f] / (1 - BM25_B + BM25_B * len(toks) / avg_len[f])
+                for tok in toks:
+                    tf[tok] = tf.get(tok, 0.0) + norm
+            for tok, w in tf.items():
+                ids, weights = postings.setdefault(tok, ([], []))
+                ids.append(i)
+                weights.append(w / (BM25_K1 + w))
+        self.postings = postings
+
+    def idf(self, term: str) -> float:
+        df = len(self.postings[term][0]) if term in self.postings else 0
+        return math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+
+    def top_k(self, query: str, k: int) -> List[int]:
+        """
+        Indexes of the k best-scoring chunks. Chunks matching no query term
+        fill any remaining slots in store order, like the overlap scan.
+        """
+        scores: Dict[int, float] = {}
+        for term in set(_tokenize(query)):
+            entry = self.postings.get(term)
+            if entry is None:
+                continue
+            idf = self.idf(term)
+            for i, w in zip(*entry):
+                scores[i] = scores.get(i, 0.0) + idf * w
+        best = heapq.nlargest(k, scores, key=lambda i: (scores[i], -i))
+        if len(best) < k:
+            seen = set(best)
+            best += [i for i in range(self.n_docs) if i not in seen][:k - len(best)]
+        return best
+
+
+def retrieve_policy_chunks_bm25(policy_store, query: str, k: int = 3) -> List[Dict[str, Any]]:
+    """
+    BM25F retrieval. Uses the store's cached index when given a PolicyStore;
+    a plain list of chunks gets a throwaway index.
+    """
+    index = getattr(policy_store, "bm25", None)
+    if index is None:
+        index = BM25Index(policy_store)
+    return [policy_store[i] for i in index.top_k(query, k)]
+
+
+def retrieve(policy_store, query: str, k: int = 3, method: str = "auto") -> List[Dict[str, Any]]:
+    """
+    Dispatch to a retriever. "auto" keeps the overlap scan for small stores
+    and switches to BM25 once the store reaches BM25_MIN_CHUNKS.
+    """
+    if method == "auto":
+        method = "bm25" if len(policy_store) >= BM25_MIN_CHUNKS else "overlap"
+    if method == "bm25":
+        return retrieve_policy_chunks_bm25(policy_store, query, k)
+    if method == "overlap":
+        return retrieve_policy_chunks(policy_store, query, k)
+    raise ValueError(f"Unknown retriever: {method!r} (expected one of {RETRIEVERS})")
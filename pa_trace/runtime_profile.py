@@ -0,0 +1,104 @@
+"""
+llama.cpp runtime profile: which GGUF to load and how to run it on this machine.
+
+A profile is a JSON object with RuntimeProfile's fields; fields left out
+keep their defaults, and other keys (e.g. autotune's measurements) are
+ignored. The active profile is resolved once per process:
+
+  1. the file named by PA_TRACE_PROFILE (set by --profile), else
+     models/runtime_profile.json if it exists;
+  2. PA_TRACE_<FIELD> environment variables on top, e.g.
+     PA_TRACE_N_THREADS=8 or PA_TRACE_MODEL_PATH=models/...Q8_0.gguf.
+
+`pa-trace autotune` measures thread/batch settings on the local machine and
+writes the fastest as a profile (see autotune.py).
+"""
+import os
+import typing
+from dataclasses import asdict, dataclass, fields, replace
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from .jsonio import _type_name, check_shape, read_json, write_json
+
+PROFILE_ENV = "PA_TRACE_PROFILE"
+REPO_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_PROFILE_PATH = REPO_DIR / "models" / "runtime_profile.json"
+
+
+@dataclass
+class RuntimeProfile:
+    # Relative paths are resolved against the repo root
+    model_path: str = "models/google_medgemma-4b-it-Q4_K_M.gguf"
+    n_ctx: int = 4096
+    n_gpu_layers: int = -1          # -1 offloads every layer (no-op on CPU builds)
+    n_threads: Optional[int] = None  # None: llama.cpp's default
+    n_batch: int = 512
+    flash_attn: bool = False
+
+    @property
+    def model_file(self) -> Path:
+        path = Path(self.model_path)
+        return path if path.is_absolute() else REPO_DIR / path
+
+    def llama_kwargs(self) -> Dict[str, Any]:
+        """Keyword arguments for llama_cpp.Llama (model_path included)."""
+        kwargs = asdict(self)
+        kwargs["model_path"] = str(self.model_file)
+        if kwargs["n_threads"] is None:
+            del kwargs["n_threads"]
+        return kwargs
+
+
+def _parse_env(raw: str, tp: Any) -> Any:
+    if tp is Optional[int]:
+        return None if raw.strip().lower() in ("", "auto", "none") else int(raw)
+    if tp is bool:
+        return raw.strip().lower() in ("1", "true", "yes", "on")
+    return tp(raw)
+
+
+def load_profile(path: Optional[Path] = None, env: Optional[Dict[str, str]] = None) -> RuntimeProfile:
+    """
+    Build a profile from a JSON file (path, else PA_TRACE_PROFILE, else
+    models/runtime_profile.json if present) plus PA_TRACE_<FIELD> overrides.
+    Raises ValueError for a malformed file or override.
+    """
+    env = os.environ if env is None else env
+    if path is None and env.get(PROFILE_ENV):
+        path = Path(env[PROFILE_ENV])
+    if path is None and DEFAULT_PROFILE_PATH.exists():
+        path = DEFAULT_PROFILE_PATH
+    profile = RuntimeProfile()
+    if path is not None:
+        try:
+            data = read_json(path)
+        except OSError as e:
+            raise ValueError(f"Cannot read runtime profile {path}: {e}") from None
+        check_shape(data, RuntimeProfile, str(path))
+        names = {f.name for f in fields(RuntimeProfile)}
+        profile = replace(profile, **{k: v for k, v in data.items() if k in names})
+
+    hints = typing.get_type_hints(RuntimeProfile)
+    overrides = {}
+    for f in fields(RuntimeProfile):
+        name = f"PA_TRACE_{f.name.upper()}"
+        if name in env:
+            try:
+                overrides[f.name] = _parse_env(env[name], hints[f.name])
+            except ValueError:
+                raise ValueError(f"{name}={env[name]!r}: expected {_type_name(hints[f.name])}") from None
+    return replace(profile, **overrides)
+
+
+@lru_cache(maxsize=1)
+def active_profile() -> RuntimeProfile:
+    """The profile this process loads models with (resolved on first use)."""
+    return load_profile()
+
+
+def write_profile(path: Path, profile: RuntimeProfile, extra: Optional[Dict[str, Any]] = None) -> None:
+    """Write a profile JSON (extra keys, e.g. measurements, go alongside the fields)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_json(path, {**asdict(profile), **(extra or {})}, pretty=True)
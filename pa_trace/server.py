@@ -0,0 +1,149 @@
+"""
+Local extraction server: keeps the GGUF model resident between requests.
+
+`pa-trace serve` loads MedGemma once and answers on localhost:
+  GET  /health   -> {"status": "ok", "model_loaded": bool, "fingerprint": str}
+  POST /extract  {"note_text": str, "retrieved_policy": [...], "mode": "llm"|"baseline"}
+                 -> extracted facts (same dict extract_facts_llm returns)
+
+`extract_remote` is the client side. The single-case `run` command tries it
+first in llm mode and loads the model in-process when no server answers;
+batch and eval never use it, since their own model contexts would sit idle
+while the server's one model took the cases in turn. "fingerprint" is the
+server's llm extractor fingerprint (model file, profile, prompt, source).
+The client only uses a server whose fingerprint matches its own, so a
+server result is always what local extraction would have cached under the
+same key.
+"""
+import ipaddress
+import json
+import os
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from . import extraction_llm
+from .cache import _extractor_fingerprint
+from .extraction_baseline import extract_facts_baseline
+from .jsonio import ExtractRequest, check_shape
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# Client side: server URL, or "off" to never try one
+SERVER_ENV = "PA_TRACE_SERVER"
+HEALTH_TIMEOUT_S = 0.5
+# The server is local: never route through HTTP(S)_PROXY
+_opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "pa-trace"
+
+    def _send_json(self, status: int, obj: Any) -> None:
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path != "/health":
+            self._send_json(404, {"error": "not found"})
+            return
+        self._send_json(200, {"status": "ok", "model_loaded": extraction_llm._model is not None,
+                              "fingerprint": _extractor_fingerprint("llm")})
+
+    def do_POST(self) -> None:
+        if self.path != "/extract":
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            req = check_shape(json.loads(self.rfile.read(length).decode("utf-8")), ExtractRequest, "request")
+        except ValueError as e:  # includes JSON and UTF-8 decode errors
+            self._send_json(400, {"error": f"bad request: {e}"})
+            return
+        note_text = req["note_text"]
+        retrieved = req.get("retrieved_policy", [])
+
+        try:
+            if req.get("mode", "llm") == "baseline":
+                extracted = extract_facts_baseline(note_text=note_text, retrieved_policy=retrieved)
+            else:
+                # Requests are served concurrently; generations on the one context are serialised in extraction_llm
+                extracted = extraction_llm.extract_facts_llm(note_text=note_text, retrieved_policy=retrieved)
+        except Exception as e:
+            print(f"[WARN] serve: extraction failed: {e!r}")
+            self._send_json(500, {"error": f"extraction failed: {e}"})
+            return
+        self._send_json(200, extracted)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        print(f"[PA-Trace] serve: {self.address_string()} {format % args}")
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+    """Load the model, then serve extraction requests until interrupted."""
+    if extraction_llm._get_model() is None:
+        print("[WARN] Model not available; llm requests will fall back to baseline")
+    if not _is_loopback(host):
+        print(f"[WARN] Serving on {host}: /extract has no authentication, "
+              f"so anyone who can reach this address can use it")
+    httpd = ThreadingHTTPServer((host, port), _Handler)
+    print(f"[PA-Trace] Serving on http://{host}:{port} (Ctrl-C to stop)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+def server_url() -> Optional[str]:
+    url = os.environ.get(SERVER_ENV, f"http://{DEFAULT_HOST}:{DEFAULT_PORT}")
+    return None if url.lower() == "off" else url.rstrip("/")
+
+
+def extract_remote(note_text: str, retrieved_policy: List[Dict[str, Any]], mode: str = "llm",
+                   url: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Extract via a running `pa-trace serve`. Returns None when no server
+    answers the health check, or when it runs a different extractor (model,
+    profile, prompt or code), so the caller can extract locally.
+    """
+    url = url or server_url()
+    if url is None:
+        return None
+    try:
+        with _opener.open(f"{url}/health", timeout=HEALTH_TIMEOUT_S) as resp:
+            health = json.loads(resp.read().decode("utf-8"))
+    except (OSError, urllib.error.URLError, ValueError):
+        return None
+    if not isinstance(health, dict) or health.get("fingerprint") != _extractor_fingerprint(mode):
+        print(f"[WARN] Extraction server at {url} runs a different model, profile or extractor code; "
+              f"extracting locally")
+        return None
+
+    body = json.dumps({"note_text": note_text, "retrieved_policy": retrieved_policy, "mode": mode}).encode("utf-8")
+    req = urllib.request.Request(f"{url}/extract", data=body, headers={"Content-Type": "application/json"})
+    try:
+        # No timeout: a CPU extraction can take minutes
+        with _opener.open(req) as resp:
+            extracted = json.loads(resp.read().decode("utf-8"))
+    except (OSError, urllib.error.URLError, ValueError) as e:
+        print(f"[WARN] Extraction server at {url} failed: {e}, extracting locally")
+        return None
+    print(f"[PA-Trace] Extracted via server at {url}")
+    return extracted
@@ -0,0 +1,69 @@
+"""
+Lightweight per-case timing spans.
+
+    with collect() as timings:       # one dict per case
+        with span("retrieval"):
+            ...
+
+Spans opened outside a collect() block cost one ContextVar lookup and
+record nothing. The active dict lives in a ContextVar, so it follows a case
+through asyncio.to_thread; repeated span names accumulate.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, Iterator, List, Optional
+
+_current: ContextVar[Optional[Dict[str, float]]] = ContextVar("pa_trace_timings", default=None)
+
+
+@contextmanager
+def collect(timings: Optional[Dict[str, float]] = None) -> Iterator[Dict[str, float]]:
+    """
+    Collect spans opened inside the block into a {name: seconds} dict (fresh,
+    or `timings` to continue one case's collection in a later block).
+    """
+    if timings is None:
+        timings = {}
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+def record(name: str, seconds: float) -> None:
+    """Add an externally measured duration to the active collection."""
+    timings = _current.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    if _current.get() is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - t0)
+
+
+def merge(into: Dict[str, float], spans: Dict[str, float]) -> None:
+    """Add spans collected elsewhere (another thread's collect()) into a case's dict."""
+    for name, seconds in spans.items():
+        into[name] = into.get(name, 0.0) + seconds
+
+
+def percentiles(values: Iterable[float], qs: Iterable[int] = (50, 95, 99)) -> Dict[str, float]:
+    """Nearest-rank percentiles, e.g. {"p50": ..., "p95": ..., "p99": ...}."""
+    ordered: List[float] = sorted(values)
+    out: Dict[str, float] = {}
+    if not ordered:
+        return out
+    for q in qs:
+        rank = max(1, -(-q * len(ordered) // 100))  # ceil(q/100 * n)
+        out[f"p{q}"] = ordered[rank - 1]
+    return out